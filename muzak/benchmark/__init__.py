@@ -0,0 +1,37 @@
+"""
+Benchmarks for the scanner and library import paths. Each module can be run with
+python -m, e.g. python -m muzak.benchmark.tags /path/to/music
+"""
+import time
+
+
+def bytes_read() -> int:
+    """
+    Total bytes this process has read through read() calls, from /proc/self/io, or
+    None where that isn't available.
+    """
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Timer:
+    """
+    Context manager recording elapsed wall time and bytes read.
+    """
+    def __enter__(self):
+        self.bytes = None
+        self._bytes = bytes_read()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self._start
+        end = bytes_read()
+        if end is not None and self._bytes is not None:
+            self.bytes = end - self._bytes
@@ -0,0 +1,130 @@
+"""
+Measure database insert and lookup throughput on synthetic track rows, without touching
+any audio files.
+
+    python -m muzak.benchmark.db --rows 20000 --output db.json
+    python -m muzak.benchmark.db --modes bulk pooled --profiles default bulk-import serving
+
+Each mode runs against a fresh database, once per SQLite performance profile. "pooled" shares one connection per thread between
+statements, "unpooled" opens a new connection for every statement, and "bulk" inserts
+through Track.bulk_new on a pooled connection. Lookups are also timed through a warm
+row cache (Model.enable_cache).
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from typing import List
+
+from muzak import db
+from muzak.benchmark import Timer
+from muzak.benchmark.generate import Generator
+
+MODES = ["pooled", "unpooled", "bulk"]
+
+
+def synthetic_rows(count: int, seed: int = 0) -> List[dict]:
+    """
+    Build count track dicts shaped like the ones Library.add_track inserts.
+    """
+    generator = Generator(seed=seed)
+    rows = []
+    album = []
+    while len(rows) < count:
+        if not album:
+            album = generator.album()
+        tags = album.pop(0)
+        row = dict(tags)
+        row["year"] = int(tags["year"])
+        row["duration"] = 180 + len(rows) % 240
+        row["sample_rate"] = 44100
+        row["bitrate"] = 320
+        row["path"] = "/library/%s/%s/%s [%s].flac" % (tags["album_artist"], tags["album"], tags["title"], tags["isrc"])
+        row["size"] = 1024 * 1024 * 30
+        row["mtime_ns"] = 1700000000000000000 + len(rows)
+        row["inode"] = len(rows) + 1
+        row["device"] = 2049
+        rows.append(row)
+    return rows
+
+
+def _open_database(path: str):
+    from muzak.db.models import Track
+    db.DB_PATH = path
+    Track._autoupgrade()
+    return Track
+
+
+def run(mode: str, rows: List[dict], workdir: str, lookups: int = 5000, profile: str = "default") -> dict:
+    db.configure(profile)
+    db.POOLED = mode != "unpooled"
+    path = os.path.join(workdir, "%s-%s.db" % (mode, profile))
+    Track = _open_database(path)
+    with Timer() as insert:
+        if mode == "bulk":
+            Track.bulk_new(rows)
+        else:
+            for row in rows:
+                Track.new(**row)
+    paths = [row["path"] for row in rows[:lookups]]
+    with Timer() as lookup:
+        for p in paths:
+            Track(path=p)
+    # The same lookups again through the row cache, once warm
+    cache = Track.enable_cache(len(paths))
+    for p in paths:
+        Track(path=p)
+    with Timer() as cached:
+        for p in paths:
+            Track(path=p)
+    Track.disable_cache()
+    with Timer() as listing:
+        Track.artists()
+        Track.albums()
+    db.configure()
+    db.POOLED = True
+    return {
+        "mode": mode,
+        "profile": profile,
+        "rows": len(rows),
+        "insert_seconds": round(insert.seconds, 4),
+        "inserts_per_sec": round(len(rows) / insert.seconds, 1) if insert.seconds else None,
+        "lookups": len(paths),
+        "lookups_per_sec": round(len(paths) / lookup.seconds, 1) if lookup.seconds else None,
+        "cached_lookups_per_sec": round(len(paths) / cached.seconds, 1) if cached.seconds else None,
+        "cache_hit_rate": cache.stats()["hit_rate"],
+        "listing_seconds": round(listing.seconds, 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark track inserts and lookups")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--modes", choices=MODES, nargs="+", default=MODES)
+    parser.add_argument("--profiles", choices=list(db.PROFILES), nargs="+", default=["default"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Directory for the databases (default: a temporary directory)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+    rows = synthetic_rows(args.rows, seed=args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="muzak-bench-db-")
+    results = {"sqlite": sqlite3.sqlite_version, "runs": []}
+    try:
+        for profile in args.profiles:
+            for mode in args.modes:
+                result = run(mode, rows, workdir, lookups=args.lookups, profile=profile)
+                results["runs"].append(result)
+                print(json.dumps(result), flush=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Generate a synthetic music collection of small but valid MP3, FLAC and Ogg Vorbis files
+with randomized tags, written through mutagen.
+
+    python -m muzak.benchmark.generate /tmp/synthetic --count 10000 --shape nested
+"""
+import argparse
+import os
+import random
+import struct
+from typing import List
+
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3, TALB, TCON, TDRC, TIT2, TPE1, TPE2, TPOS, TRCK, TSRC
+from mutagen.ogg import OggPage
+from mutagen.oggvorbis import OggVorbis
+
+SHAPES = ["nested", "deep", "wide"]
+FORMATS = ["mp3", "flac", "ogg"]
+
+WORDS = [
+    "Black", "Blue", "Broken", "City", "Cold", "Dark", "Dead", "Dream", "Electric", "Fire",
+    "Ghost", "Golden", "Heart", "Highway", "Iron", "Last", "Light", "Lost", "Midnight", "Moon",
+    "Night", "Ocean", "Paper", "Red", "River", "Rose", "Shadow", "Silver", "Sky", "Stone",
+    "Summer", "Sun", "Thunder", "Velvet", "Water", "White", "Wild", "Winter", "Wolf", "Young"
+]
+NON_ASCII_WORDS = ["Café", "Über", "Ñandú", "Øresund", "Łódź", "Smörgåsbord", "Mötley", "東京", "Мир", "Ελλάδα"]
+GENRES = ["Rock", "Punk", "Jazz", "Blues", "Electronic", "Hip-Hop", "Folk", "Metal", "Pop", "Classical"]
+
+# One silent MPEG-1 Layer III frame, 128 kbit/s at 44.1 kHz
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def _flac_template() -> bytes:
+    sample_rate, channels, bits, samples = 44100, 2, 16, 44100 * 30
+    info = struct.pack(">HH", 4096, 4096) + b"\x00" * 6
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits - 1) << 36) | samples
+    info += packed.to_bytes(8, "big") + b"\x00" * 16
+    return b"fLaC" + bytes([0x80]) + len(info).to_bytes(3, "big") + info + b"\xff\xf8" + b"\x00" * 64
+
+
+def _ogg_template() -> bytes:
+    ident = b"\x01vorbis" + struct.pack("<IBIiii", 0, 2, 44100, 0, 128000, 0) + b"\xb8\x01"
+    comment = b"\x03vorbis" + struct.pack("<I", 0) + struct.pack("<I", 0) + b"\x01"
+    setup = b"\x05vorbis" + b"\x00" * 32
+    pages = []
+    for sequence, packets in enumerate([[ident], [comment, setup], [b"\x00" * 32]]):
+        page = OggPage()
+        page.packets = packets
+        page.sequence = sequence
+        page.serial = 1
+        page.position = 0 if sequence < 2 else 44100 * 30
+        page.first = sequence == 0
+        page.last = sequence == 2
+        pages.append(page.write())
+    return b"".join(pages)
+
+
+TEMPLATES = {
+    "mp3": MP3_FRAME * 8,
+    "flac": _flac_template(),
+    "ogg": _ogg_template()
+}
+
+
+def _write_mp3(path: str, tags: dict):
+    audio = ID3()
+    audio.add(TIT2(encoding=3, text=tags["title"]))
+    audio.add(TPE1(encoding=3, text=tags["artist"]))
+    audio.add(TALB(encoding=3, text=tags["album"]))
+    audio.add(TPE2(encoding=3, text=tags["album_artist"]))
+    audio.add(TRCK(encoding=3, text=str(tags["track"])))
+    audio.add(TPOS(encoding=3, text=str(tags["disc"])))
+    audio.add(TCON(encoding=3, text=tags["genre"]))
+    audio.add(TDRC(encoding=3, text=tags["year"]))
+    audio.add(TSRC(encoding=3, text=tags["isrc"]))
+    audio.save(path)
+
+
+def _write_vorbis(audio, tags: dict):
+    audio["title"] = tags["title"]
+    audio["artist"] = tags["artist"]
+    audio["album"] = tags["album"]
+    audio["albumartist"] = tags["album_artist"]
+    audio["tracknumber"] = str(tags["track"])
+    audio["discnumber"] = str(tags["disc"])
+    audio["genre"] = tags["genre"]
+    audio["date"] = tags["year"]
+    audio["isrc"] = tags["isrc"]
+    audio.save()
+
+
+WRITERS = {
+    "mp3": _write_mp3,
+    "flac": lambda path, tags: _write_vorbis(FLAC(path), tags),
+    "ogg": lambda path, tags: _write_vorbis(OggVorbis(path), tags)
+}
+
+
+class Generator:
+    """
+    Builds albums of randomized tracks. The same seed always produces the same collection.
+    """
+    def __init__(self, seed: int = 0, non_ascii: float = 0.1, duplicates: float = 0.02):
+        """
+        :param seed: Random seed.
+        :param non_ascii: Fraction of names that use non-ASCII words.
+        :param duplicates: Fraction of files that repeat the tags of an earlier file.
+        """
+        self.random = random.Random(seed)
+        self.non_ascii = non_ascii
+        self.duplicates = duplicates
+        self.isrcs = 0
+
+    def _name(self, words: int) -> str:
+        pool = NON_ASCII_WORDS if self.random.random() < self.non_ascii else WORDS
+        return " ".join(self.random.choice(pool) for _ in range(words))
+
+    def album(self) -> List[dict]:
+        artist = self._name(2)
+        album = self._name(self.random.randint(1, 3))
+        year = str(self.random.randint(1960, 2024))
+        genre = [self.random.choice(GENRES)]
+        discs = 2 if self.random.random() < 0.1 else 1
+        tracks = []
+        for disc in range(1, discs + 1):
+            for number in range(1, self.random.randint(8, 14) + 1):
+                self.isrcs += 1
+                track_artist = [artist]
+                if self.random.random() < 0.15:
+                    track_artist.append(self._name(2))
+                tracks.append({
+                    "title": self._name(self.random.randint(1, 4)),
+                    "artist": track_artist,
+                    "album": album,
+                    "album_artist": artist,
+                    "track": number,
+                    "disc": disc,
+                    "genre": genre,
+                    "year": year,
+                    "isrc": "US%s%07d" % (self.random.choice(["ABC", "XYZ", "MZK"]), self.isrcs)
+                })
+        return tracks
+
+    def _directory(self, root: str, shape: str, index: int, tags: dict) -> str:
+        if shape == "wide":
+            return os.path.join(root, "incoming")
+        if shape == "deep":
+            parts = ["%02d" % ((index // 1000) % 100), "%02d" % ((index // 100) % 10), tags["album_artist"], tags["year"], tags["album"], "Disc %d" % tags["disc"]]
+            return os.path.join(root, *parts)
+        return os.path.join(root, tags["album_artist"], tags["album"])
+
+    def generate(self, root: str, count: int, shape: str = "nested") -> List[str]:
+        """
+        Write count files under root and return their paths.
+        :param shape: "nested" for artist/album directories, "deep" for six levels of
+                      nesting, or "wide" for a single directory holding every file.
+        """
+        if shape not in SHAPES:
+            raise ValueError(f"Unsupported shape {shape}")
+        paths = []
+        written = []
+        album = []
+        while len(paths) < count:
+            if not album:
+                album = self.album()
+            if written and self.random.random() < self.duplicates:
+                tags = self.random.choice(written)
+            else:
+                tags = album.pop(0)
+            fmt = FORMATS[len(paths) % len(FORMATS)]
+            directory = self._directory(root, shape, len(paths), tags)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, "%05d %s.%s" % (len(paths), tags["title"], fmt))
+            with open(path, "wb") as f:
+                f.write(TEMPLATES[fmt])
+            WRITERS[fmt](path, tags)
+            written.append(tags)
+            paths.append(path)
+        return paths
+
+
+def generate(root: str, count: int, shape: str = "nested", seed: int = 0, non_ascii: float = 0.1, duplicates: float = 0.02) -> List[str]:
+    """
+    Write a synthetic collection of count files under root and return their paths.
+    """
+    return Generator(seed=seed, non_ascii=non_ascii, duplicates=duplicates).generate(root, count, shape=shape)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic music collection")
+    parser.add_argument("path", help="Directory to write files to")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--shape", choices=SHAPES, default="nested")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--non-ascii", type=float, default=0.1, help="Fraction of names using non-ASCII words")
+    parser.add_argument("--duplicates", type=float, default=0.02, help="Fraction of files repeating an earlier file's tags")
+    args = parser.parse_args()
+    paths = generate(args.path, args.count, shape=args.shape, seed=args.seed, non_ascii=args.non_ascii, duplicates=args.duplicates)
+    print(f"Wrote {len(paths)} files to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
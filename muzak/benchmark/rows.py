@@ -0,0 +1,78 @@
+"""
+Compare the memory and time it takes to hold query results as Track objects against
+the dict-backed rows of muzak.db.OldModel, which decode every JSON field up front.
+
+    python -m muzak.benchmark.rows --rows 100000
+
+Rows are fetched once, then each representation is built from the same sqlite3.Row
+objects. "path" reads one plain field per row, "artist" reads a JSON field.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from muzak import db
+from muzak.benchmark.db import synthetic_rows
+from muzak.db import OldModel
+from muzak.db.models import Track
+
+
+class DictTrack(OldModel):
+    _table = Track._table
+    _fields = Track._fields
+    _uniques = Track._uniques
+    _json_fields = Track._json_fields
+
+
+def _measure(cls, rows: list) -> dict:
+    start = time.perf_counter()
+    objects = [cls(from_dict=row) for row in rows]
+    build = time.perf_counter() - start
+    del objects
+    # Built a second time for the memory figure, tracing slows allocation down
+    tracemalloc.start()
+    objects = [cls(from_dict=row) for row in rows]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for obj in objects:
+        obj["path"]
+    path = time.perf_counter() - start
+    start = time.perf_counter()
+    for obj in objects:
+        obj["artist"]
+    artist = time.perf_counter() - start
+    return {
+        "model": cls.__name__,
+        "rows": len(rows),
+        "build_seconds": round(build, 4),
+        "bytes_per_row": round(memory / len(rows)) if rows else None,
+        "path_seconds": round(path, 4),
+        "artist_seconds": round(artist, 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Track row objects")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="muzak-bench-rows-")
+    try:
+        db.DB_PATH = os.path.join(workdir, "rows.db")
+        Track._autoupgrade()
+        Track.bulk_new(synthetic_rows(args.rows, seed=args.seed))
+        rows = Track.execute("SELECT * FROM tracks")
+        for cls in (DictTrack, Track):
+            print(json.dumps(_measure(cls, rows)), flush=True)
+    finally:
+        db.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
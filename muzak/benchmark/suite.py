@@ -0,0 +1,134 @@
+"""
+Time each stage of a library import on synthetic collections and write the results as JSON,
+so runs from different releases can be compared.
+
+    python -m muzak.benchmark.suite --sizes 1000 10000 100000 --output results.json
+
+Stages are timed separately: walking the tree, reading tags, building filenames, copying
+files into the library, and inserting rows. The "import" stage then runs Library.add_tracks
+end to end into a second, empty library.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import muzak
+from muzak.benchmark import Timer
+from muzak.benchmark.generate import SHAPES, generate
+from muzak.scanner import Scanner, fingerprint
+
+
+def _stage(timer: Timer, count: int) -> dict:
+    return {
+        "seconds": round(timer.seconds, 4),
+        "per_sec": round(count / timer.seconds, 1) if timer.seconds else None,
+        "bytes_read": timer.bytes
+    }
+
+
+def _open_library(workdir: str, name: str):
+    # Imported late so MUZAK_DATA_DIR is in place before the library picks its database path
+    from muzak.library import Library
+    os.environ["MUZAK_DATA_DIR"] = os.path.join(workdir, "data")
+    os.makedirs(os.environ["MUZAK_DATA_DIR"], exist_ok=True)
+    library = Library(os.path.join(workdir, name), create=True)
+    library.logger.setLevel("WARNING")
+    return library
+
+
+def run_stages(source: str, workdir: str, jobs: int = 1) -> dict:
+    """
+    Run every stage against the files under source, using workdir for libraries and databases.
+    """
+    from muzak.db.models import Track
+    stages = {}
+    with Timer() as timer:
+        files = list(Scanner(source).iter_files())
+    count = len(files)
+    stages["walk"] = _stage(timer, count)
+
+    with Timer() as timer:
+        infos = [info for _, info, error in Scanner.iter_tags(files, workers=jobs) if error is None]
+    stages["tags"] = _stage(timer, count)
+
+    library = _open_library(workdir, "staged")
+    with Timer() as timer:
+        targets = []
+        for info in infos:
+            sanitized = library._sanitize_trackinfo(info)
+            targets.append((info, library.path / library._build_filename(sanitized)))
+    stages["filenames"] = _stage(timer, count)
+
+    with Timer() as timer:
+        copied = []
+        for info, target in targets:
+            if target.exists():
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(info["path"], target)
+            copied.append((info, target))
+    stages["copy"] = _stage(timer, len(copied))
+
+    with Timer() as timer:
+        for info, target in copied:
+            info["path"] = str(target)
+            info.update(fingerprint(target.stat()))
+        Track.bulk_new(info for info, _ in copied)
+    stages["db_insert"] = _stage(timer, len(copied))
+
+    library = _open_library(workdir, "imported")
+    with Timer() as timer:
+        library.add_tracks(Scanner(source).iter_files(), jobs=jobs)
+    stages["import"] = _stage(timer, count)
+    return {"files": count, "stages": stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scanner and library import stages")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--shapes", choices=SHAPES, nargs="+", default=["nested"])
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes used to read tags")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Directory for generated files (default: a temporary directory)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+    results = {
+        "muzak": muzak.__version__,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "jobs": args.jobs,
+        "runs": []
+    }
+    base = args.workdir or tempfile.mkdtemp(prefix="muzak-bench-")
+    try:
+        for shape in args.shapes:
+            for size in args.sizes:
+                workdir = os.path.join(base, f"{shape}-{size}")
+                source = os.path.join(workdir, "source")
+                if not os.path.isdir(source):
+                    with Timer() as timer:
+                        generate(source, size, shape=shape, seed=args.seed)
+                    print(f"Generated {size} {shape} files in {timer.seconds:.1f}s", flush=True)
+                for name in ("data", "staged", "imported"):
+                    shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+                run = run_stages(source, workdir, jobs=args.jobs)
+                run.update({"shape": shape, "size": size})
+                results["runs"].append(run)
+                print(json.dumps(run), flush=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(base, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
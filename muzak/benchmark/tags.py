@@ -0,0 +1,65 @@
+"""
+Compare the header-only tag reader in muzak.fasttags against taglib.
+
+    python -m muzak.benchmark.tags /mnt/share/music --mode both --limit 2000
+
+Each mode reads the same files, so run the modes separately against a freshly mounted
+share when page cache effects matter. Bytes read are taken from /proc/self/io and
+include everything the process read while the mode ran.
+"""
+import argparse
+import json
+
+from muzak import fasttags
+from muzak.benchmark import Timer
+from muzak.scanner import TAG_KEYS, Scanner
+
+
+def run(files: list, fast: bool) -> dict:
+    fallbacks = 0
+    with Timer() as timer:
+        for f in files:
+            tags = fasttags.read_tags(f, keys=TAG_KEYS) if fast else None
+            if tags is None:
+                if fast:
+                    fallbacks += 1
+                Scanner.read_tags(f, fast=False)
+    result = {
+        "mode": "fast" if fast else "taglib",
+        "files": len(files),
+        "seconds": round(timer.seconds, 4),
+        "files_per_sec": round(len(files) / timer.seconds, 1) if timer.seconds else None,
+        "bytes_read": timer.bytes,
+        "bytes_per_file": round(timer.bytes / len(files)) if timer.bytes is not None and files else None
+    }
+    if fast:
+        result["taglib_fallbacks"] = fallbacks
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tag reading against taglib")
+    parser.add_argument("path", help="Directory of music files to read")
+    parser.add_argument("--mode", choices=["fast", "taglib", "both"], default="both")
+    parser.add_argument("--limit", type=int, default=0, help="Read at most this many files")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+    files = []
+    for f in Scanner(args.path).iter_files():
+        files.append(f)
+        if args.limit and len(files) >= args.limit:
+            break
+    results = []
+    if args.mode in ("fast", "both"):
+        results.append(run(files, fast=True))
+    if args.mode in ("taglib", "both"):
+        results.append(run(files, fast=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -35,11 +35,10 @@ class MuzakCli:
         Scan the given path for music files.
         :param path: The path to scan.
         :param exclude_subdirs: Whether to exclude subdirectories.
-        :param exclude: A list of files to exclude.
+        :param exclude: Paths or gitignore-style patterns to exclude.
         """
-        # print(exclude)
         scanner = Scanner(path, subdirs=not exclude_subdirs)
-        files = scanner.scan() #(exclude=exclude)
+        files = scanner.iter_files(exclude_dirs=exclude)
         for f in files:
             print(f)
 
@@ -117,21 +116,24 @@ class MuzakCli:
             self.library = Library(MuzakCli.config["library"], debug=MuzakCli.debug)
             self.logger = self.library.logger
 
-        def _add_folder(self, path: str, move: bool = False, exclude_subdirs: bool = False, exclude: list = None):
+        def _add_folder(self, path: str, move: bool = False, exclude_subdirs: bool = False, exclude: list = None, jobs: int = 1):
             scanner = Scanner(path, subdirs=not exclude_subdirs)
-            files = scanner.scan(exclude_dirs=exclude)
-            return self.library.add_tracks(files, move=move)
+            files = scanner.iter_files(exclude_dirs=exclude)
+            return self.library.add_tracks(files, move=move, jobs=jobs)
 
-        def add(self, path: str, move: bool = False, exclude_subdirs: bool = False, exclude: list = None):
+        def add(self, path: str, move: bool = False, exclude_subdirs: bool = False, exclude: list = None, jobs: int = 1, stats: str = None):
             """
             Add the given path to the library.
             :param path: The path to add.
             :param move: Whether to move the file to the library.
+            :param exclude: Directories or gitignore-style patterns (relative to path) to skip, in addition to any .muzakignore files.
+            :param jobs: Number of worker processes used to read tags (0 for one per CPU).
+            :param stats: Write per-stage counters and timings as JSON to this file when done.
             """
             path = Path(path)
             if path.is_dir():
                 self.logger.info(f"Scanning [{path}] for music files ...")
-                errors = self._add_folder(path, move=move, exclude_subdirs=exclude_subdirs, exclude=exclude)
+                errors = self._add_folder(path, move=move, exclude_subdirs=exclude_subdirs, exclude=exclude, jobs=jobs)
                 if len(errors) > 0:
                     print("Failed to add the following files:")
                     for e in errors:
@@ -139,20 +141,22 @@ class MuzakCli:
             elif path.is_file():
                 self.logger.info(f"Adding [{path}]")
                 self.library.add_track(str(path), move=move)
+            if stats:
+                self.library.stats.dump(stats)
 
         def details(self, output: str = "table", skip_isrc: bool = False):
             """
             Print details about the given library.
             """
+            totals = self.library.totals()
             tbl_data = {
                 "Library": str(self.library.path),
-                "Tracks": len(self.library.get()),
-                "Artists": len(self.library.artists()),
-                "Albums": len(self.library.albums()),
+                "Tracks": totals["tracks"],
+                "Artists": totals["artists"],
+                "Albums": totals["albums"],
             }
             if not skip_isrc:
-                no_isrc = Track.no_isrc()
-                pathlist = [str(i["path"]) for i in no_isrc]
+                pathlist = [str(path) for path in Track.column("path", isrc="Unknown")]
                 tbl_data["Tracks w/o ISRC (%d)" % len(pathlist)] = pathlist
             if output == "table":
                 print_table(tbl_data)
@@ -193,11 +197,16 @@ class MuzakCli:
             track = Track(id=track_id)
             track[tag] = value
 
-        def scan(self):
+        def scan(self, jobs: int = 1, incremental: bool = False, stats: str = None):
             """
             Scan the library for new files.
+            :param jobs: Number of worker processes used to read tags (0 for one per CPU).
+            :param incremental: Only re-read tags for files that changed since the last scan, and prune deleted files.
+            :param stats: Write per-stage counters and timings as JSON to this file when done.
             """
-            errors = self.library.scan()
+            errors = self.library.scan(jobs=jobs, incremental=incremental)
+            if stats:
+                self.library.stats.dump(stats)
             if len(errors) > 0:
                 print("Failed to add the following files:")
                 for e in errors:
@@ -209,13 +218,48 @@ class MuzakCli:
             """
             self.library.prune()
 
-        def search(self, query: str, ids: bool = False):
+        def watch(self, inbox: list = None, settle: int = 2, jobs: int = 1):
+            """
+            Watch the library and its inboxes for changes and keep the database up to date (Linux only).
+            :param inbox: Directories whose new files are moved into the library, in addition to the library's configured inboxes.
+            :param settle: Seconds a file has to be quiet before it is imported.
+            :param jobs: Number of worker processes used to read tags (0 for one per CPU).
+            """
+            try:
+                self.library.watch(inboxes=inbox, settle=settle, jobs=jobs)
+            except OSError as e:
+                print("Error: %s" % str(e))
+                exit(1)
+
+        def albums(self, artist: str = None, output: str = "table"):
+            """
+            List albums with their track count, running time and year.
+            :param artist: Only list albums by this album artist.
+            :param output: Output format (table or json).
+            """
+            albums = self.library.album_summaries(album_artist=artist)
+            if output == "json":
+                print(json.dumps([dict(album._data) for album in albums]), flush=True)
+                return
+            for album in albums:
+                duration = album["duration"] if isinstance(album["duration"], int) else 0
+                minutes, seconds = divmod(duration, 60)
+                print(f"{album['album_artist']} - {album['album']} ({album['year']}, {album['track_count']} tracks, {minutes}:{seconds:02d})")
+
+        def rebuild_summaries(self):
+            """
+            Recompute the album and artist summaries used by details and albums.
+            """
+            self.library.rebuild_summaries()
+
+        def search(self, query: str, ids: bool = False, limit: int = None):
             """
             Search the library for the given query.
-            :param query: The query to search for.
+            :param query: The query to search for. Every word has to match the start of a word in the title, artist or album.
             :param ids: Whether to print IDs with paths.
+            :param limit: Maximum number of results.
             """
-            tracks = self.library.search(query)
+            tracks = self.library.search(query, limit=limit)
             track_results = {}
             for track in tracks:
                 if ids:
@@ -1,8 +1,14 @@
+from contextlib import contextmanager
 from datetime import datetime
+import atexit
+import re
 import sqlite3
+import threading
 import json
 import os
 
+from muzak.db.cache import RowCache, clear_all as _clear_caches
+
 
 # DB_PATH = None
 # INIT_SCHEMA = """
@@ -43,18 +49,197 @@ import os
 #     conn.close()
 
 DB_PATH = None
+# Keep one connection per thread open and share it between calls. When disabled every
+# connect() opens a fresh connection, as it used to.
+POOLED = True
+
+# PRAGMAs every new connection runs, set through configure()
+PRAGMA_NAMES = ["journal_mode", "synchronous", "mmap_size", "cache_size", "temp_store", "busy_timeout"]
+PROFILES = {
+    # SQLite's own defaults. Note that WAL, once set by another profile, stays on the database file.
+    "default": {},
+    # One process importing as fast as it can. A power cut mid-import can corrupt the
+    # database, which a rescan of the library rebuilds.
+    "bulk-import": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "mmap_size": 268435456,
+        "cache_size": -262144,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000
+    },
+    # Readers running alongside an occasional writer, such as the watcher or an API.
+    "serving": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 1073741824,
+        "cache_size": -65536,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000
+    },
+    # Every commit synced to disk before returning.
+    "durable": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000
+    }
+}
+PRAGMAS = {}
+# Prepared statements each connection keeps, enough for every template Model builds
+STATEMENT_CACHE = 256
+# Ids bound per statement by delete_many, well under SQLite's variable limit
+ID_CHUNK = 500
+# INSERT ... ON CONFLICT DO UPDATE needs SQLite 3.24, and RETURNING 3.35
+UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+_local = threading.local()
+_lock = threading.Lock()
+_connections = []
+_generation = 0
+
+def _open():
+    # Connections never cross threads, but close_all() may run on another thread
+    db = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False, cached_statements=STATEMENT_CACHE)
+    db.row_factory = sqlite3.Row
+    for name, value in PRAGMAS.items():
+        # journal_mode answers with a row, which has to be read for the change to apply
+        db.execute("PRAGMA %s = %s" % (name, value)).fetchall()
+    return db
+
+def configure(profile: str = "default", **pragmas):
+    """
+    Pick the PRAGMAs applied to every connection: a profile from PROFILES, with any of
+    PRAGMA_NAMES given as keyword arguments overriding it. Pooled connections are closed so
+    the next connect() picks the new settings up.
+    """
+    if profile not in PROFILES:
+        raise ValueError("Unknown performance profile %s, expected one of %s" % (profile, ", ".join(PROFILES)))
+    settings = dict(PROFILES[profile])
+    for name, value in pragmas.items():
+        if name not in PRAGMA_NAMES:
+            raise ValueError("Unsupported PRAGMA %s" % name)
+        if not re.match(r"^-?[A-Za-z0-9_]+$", str(value)):
+            raise ValueError("Invalid value for PRAGMA %s: %s" % (name, value))
+        settings[name] = value
+    PRAGMAS.clear()
+    PRAGMAS.update(settings)
+    close_all()
+
+def _discard(db):
+    with _lock:
+        _connections[:] = [i for i in _connections if i[1] is not db]
+    db.close()
 
 def connect():
+    """
+    Return a connection to DB_PATH and a new cursor on it. The connection is shared by every
+    call on the same thread until DB_PATH changes or close_all() is called, so callers should
+    hand both back to close(), which only closes the cursor of a pooled connection.
+    """
     if DB_PATH is None:
         raise Exception("No database path set")
-
-    db = sqlite3.connect(DB_PATH, isolation_level=None)
-    db.row_factory = sqlite3.Row
+    pinned = getattr(_local, "pinned", None)
+    if pinned is not None:
+        return pinned, pinned.cursor()
+    if not POOLED:
+        db = _open()
+        return db, db.cursor()
+    # The pid is part of the key so a forked child never reuses its parent's connection
+    key = (str(DB_PATH), os.getpid(), _generation)
+    pooled = getattr(_local, "connection", None)
+    if pooled is None or pooled[0] != key:
+        if pooled is not None and pooled[0][1:] == key[1:]:
+            _discard(pooled[1])
+        db = _open()
+        with _lock:
+            _connections.append((os.getpid(), db))
+        pooled = _local.connection = (key, db)
+    db = pooled[1]
     return db, db.cursor()
 
 def close(conn, cursor):
     cursor.close()
-    conn.close()
+    if conn is getattr(_local, "pinned", None):
+        return
+    pooled = getattr(_local, "connection", None)
+    if pooled is None or pooled[1] is not conn:
+        conn.close()
+
+@contextmanager
+def checkout():
+    """
+    Context manager yielding a cursor on this thread's connection.
+
+        with checkout() as cursor:
+            cursor.execute("SELECT ...")
+    """
+    conn, cursor = connect()
+    try:
+        yield cursor
+    finally:
+        close(conn, cursor)
+
+@contextmanager
+def transaction():
+    """
+    Run the block in one transaction, committed at the end or rolled back if it raises.
+    Every connect() on this thread inside the block gets the same connection. A
+    transaction() inside another one runs in a savepoint, so if it raises only its own
+    changes are rolled back and the outer transaction can carry on.
+
+        with transaction() as cursor:
+            cursor.execute("UPDATE ...")
+    """
+    conn, cursor = connect()
+    if conn is getattr(_local, "pinned", None) or conn.in_transaction:
+        depth = getattr(_local, "depth", 0) + 1
+        name = "muzak_%d" % depth
+        _local.depth = depth
+        try:
+            cursor.execute("SAVEPOINT " + name)
+            try:
+                yield cursor
+                cursor.execute("RELEASE " + name)
+            except BaseException:
+                cursor.execute("ROLLBACK TO " + name)
+                cursor.execute("RELEASE " + name)
+                _clear_caches()
+                raise
+        finally:
+            _local.depth = depth - 1
+            close(conn, cursor)
+        return
+    _local.pinned = conn
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            # Rows read inside the transaction may have been cached
+            _clear_caches()
+            raise
+    finally:
+        _local.pinned = None
+        close(conn, cursor)
+
+def close_all():
+    """
+    Close every pooled connection opened by this process. Threads open a new connection on
+    their next connect().
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        pid = os.getpid()
+        for owner, db in _connections:
+            if owner == pid:
+                db.close()
+        _connections.clear()
+
+atexit.register(close_all)
 
 def table_exists(table):
     conn, cursor = connect()
@@ -66,36 +251,54 @@ def table_exists(table):
 class NoSuchRowError(Exception):
     pass
 
+# Marks fields that weren't loaded, e.g. ones left out of a partial SELECT
+_MISSING = object()
+
 class Model:
+    """
+    A row of _table. Field values are kept in a list in _fields order rather than a dict,
+    and subclasses declare __slots__ = () so instances carry no __dict__ either. JSON
+    fields are decoded the first time they are read.
+    """
+    __slots__ = ("_values", "_pending")
     _table = None
     _fields = None
     _uniques = None
     _json_fields = None
     _dt_fields = None
-    # _cached = False
+    # Secondary indexes, index name -> list of columns
+    _indexes = None
+    # RowCache for lookups by unique field, see enable_cache
+    _cache = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls._fields is None:
+            return
+        # Field positions, the bits of JSON fields, and row column layouts seen so far
+        cls._names = tuple(cls._fields)
+        cls._index = {name: i for i, name in enumerate(cls._names)}
+        cls._json_mask = 0
+        for field in cls._json_fields or []:
+            if field in cls._index:
+                cls._json_mask |= 1 << cls._index[field]
+        cls._layouts = {}
+        # SQL text by operation and the columns it sets and matches, see _statement
+        cls._statements = {}
 
     def __init__(self, from_dict=None, **kwargs):
-        self._data = {}
         if from_dict is not None:
-            if isinstance(from_dict, sqlite3.Row):
-                from_dict = dict(from_dict)
-            for field in self._fields:
-                if field in from_dict:
-                    if self._json_fields and field in self._json_fields and isinstance(from_dict[field], str):
-                        self._data[field] = json.loads(from_dict[field])
-                    elif self._json_fields and field in self._json_fields and isinstance(from_dict[field], bytes):
-                        self._data[field] = json.loads(from_dict[field].decode("utf-8"))
-                    else:
-                        self._data[field] = from_dict[field]
+            self._load(from_dict)
         else:
-            sql = "SELECT " + ", ".join(self._fields) + " FROM " + self._table + " WHERE "
-            _ands = []
-            _vals = []
-            for field in self._uniques:
-                if field in kwargs:
-                    _ands.append(field + " = ?")
-                    _vals.append(kwargs[field])
-            sql += " AND ".join(_ands)
+            lookup = {field: kwargs[field] for field in self._uniques if field in kwargs}
+            if self._cache is not None:
+                cached = self._cache.get(str(DB_PATH), lookup)
+                if cached is not None:
+                    self._values = list(cached[0])
+                    self._pending = cached[1]
+                    return
+            sql = self._statement("select", where=tuple(lookup))
+            _vals = list(lookup.values())
             conn, cursor = connect()
             try:
                 cursor.execute(sql, tuple(_vals))
@@ -110,26 +313,126 @@ class Model:
                 else:
                     raise e
             row = cursor.fetchone()
-            # row = dict(row)
-            # close(conn, cursor)
+            close(conn, cursor)
             if row is None:
-                raise NoSuchRowError("No such row: WHERE %s" % " AND ".join(_ands))
-            row = dict(row)
-            if self._json_fields is not None:
-                for field in self._json_fields:
-                    if field in row:
-                        row[field] = json.loads(row[field])
-            self._data = row
+                raise NoSuchRowError("No such row: WHERE %s" % " AND ".join(field + " = ?" for field in lookup))
+            self._load(row)
+            if self._cache is not None:
+                key = tuple(self._values[self._index[field]] for field in self._uniques)
+                self._cache.put(str(DB_PATH), key, list(self._values), self._pending)
+
+    @classmethod
+    def enable_cache(cls, size: int = 4096):
+        """
+        Keep up to size rows in memory for lookups by unique field, and return the
+        RowCache. See muzak.db.cache.
+        """
+        cls._cache = RowCache(cls._uniques, size=size)
+        return cls._cache
+
+    @classmethod
+    def disable_cache(cls):
+        cls._cache = None
+
+    def _invalidate(self):
+        if self._cache is not None:
+            self._cache.invalidate({field: self._values[self._index[field]] for field in self._uniques if self._has(field)})
+
+    @classmethod
+    def _statement(cls, operation, columns=(), where=()):
+        """
+        The SQL for one operation on the table, built once per class and shape and reused,
+        so sqlite3's statement cache sees the same text every time. operation is one of
+        select, insert, update, set (a single-field update that also stamps updated_at)
+        or delete; columns are the fields written and where the fields matched. upsert
+        inserts columns, updating the row whose where field conflicts instead.
+        """
+        key = (operation, columns, where)
+        sql = cls._statements.get(key)
+        if sql is not None:
+            return sql
+        if operation == "upsert":
+            updates = [field for field in columns if field not in where and field not in ("id", "created_at")] or list(where)
+            sql = cls._statement("insert", columns) + " ON CONFLICT(" + ", ".join(where) + ") DO UPDATE SET " + ", ".join(field + " = excluded." + field for field in updates)
+            if RETURNING:
+                sql += " RETURNING id"
+            cls._statements[key] = sql
+            return sql
+        if operation == "select":
+            sql = "SELECT " + ", ".join(cls._fields) + " FROM " + cls._table
+        elif operation == "insert":
+            sql = "INSERT INTO " + cls._table + " (" + ", ".join(columns) + ") VALUES (" + ", ".join(["?"] * len(columns)) + ")"
+        elif operation == "update":
+            sql = "UPDATE " + cls._table + " SET " + ", ".join(field + " = ?" for field in columns)
+        elif operation == "set":
+            sql = "UPDATE " + cls._table + " SET " + columns[0] + " = ?"
+            if "updated_at" in cls._fields:
+                sql += ", updated_at = NOW()"
+        elif operation == "delete":
+            sql = "DELETE FROM " + cls._table
+        else:
+            raise ValueError("Unknown operation %s" % operation)
+        if where:
+            sql += " WHERE " + " AND ".join(field + " = ?" for field in where)
+        cls._statements[key] = sql
+        return sql
+
+    def _load(self, row):
+        names = self._names
+        if isinstance(row, sqlite3.Row):
+            keys = tuple(row.keys())
+            if keys == names:
+                values = list(row)
+            else:
+                layout = self._layouts.get(keys)
+                if layout is None:
+                    layout = [(i, self._index[key]) for i, key in enumerate(keys) if key in self._index]
+                    self._layouts[keys] = layout
+                values = [_MISSING] * len(names)
+                for i, j in layout:
+                    values[j] = row[i]
+        else:
+            values = [row.get(name, _MISSING) for name in names]
+        pending = 0
+        if self._json_mask:
+            for i, value in enumerate(values):
+                if self._json_mask >> i & 1 and isinstance(value, (str, bytes)):
+                    pending |= 1 << i
+        self._values = values
+        self._pending = pending
+
+    def _has(self, name):
+        return self._values[self._index[name]] is not _MISSING
+
+    def _set(self, name, value):
+        i = self._index[name]
+        self._values[i] = value
+        self._pending &= ~(1 << i)
+
+    @property
+    def _data(self):
+        """
+        The loaded fields as a dict.
+        """
+        return {name: self[name] for name, value in zip(self._names, self._values) if value is not _MISSING}
 
     def __getitem__(self, name):
-        if name in self._fields:
-            return self._data[name]
-        raise AttributeError("No such attribute: %s" % name)
+        i = self._index.get(name)
+        if i is None:
+            raise AttributeError("No such attribute: %s" % name)
+        value = self._values[i]
+        if value is _MISSING:
+            raise KeyError(name)
+        if self._pending >> i & 1:
+            value = json.loads(value)
+            self._values[i] = value
+            self._pending &= ~(1 << i)
+        return value
 
     def __setitem__(self, name, value):
         if name in self._fields:
             if name not in self._uniques:
-                self._data[name] = value
+                self._set(name, value)
                 if self._json_fields is not None:
                     if name in self._json_fields:
                         value = json.dumps(value)
@@ -137,19 +440,14 @@ class Model:
                     if name in self._dt_fields:
                         if isinstance(value, datetime):
                             value = value.isoformat()
-                conn, cursor = connect()
-                if "updated_at" in self._fields:
-                    sql = "UPDATE " + self._table + " SET " + name + " = ?, updated_at = NOW() WHERE "
-                else:
-                    sql = "UPDATE " + self._table + " SET " + name + " = ? WHERE "
-                _ands = []
+                sql = self._statement("set", (name,), tuple(self._uniques))
                 _vals = [value]
                 for field in self._uniques:
-                    _ands.append(field + " = ?")
-                    _vals.append(self._data[field])
-                sql += " AND ".join(_ands)
+                    _vals.append(self[field])
+                conn, cursor = connect()
                 cursor.execute(sql, tuple(_vals))
                 close(conn, cursor)
+                self._invalidate()
 
     def __delitem__(self, name):
         raise Exception("Cannot delete attributes from Model objects")
@@ -166,29 +464,52 @@ class Model:
     def __dir__(self):
         return self._fields
 
+    @classmethod
+    def _create_sql(cls, table=None):
+        """
+        The CREATE TABLE statement for the declared fields, optionally under another name.
+        """
+        _fields = []
+        for field, info in cls._fields.items():
+            if "type" not in info:
+                raise Exception("Missing type for field %s" % field)
+            primary_key = info.get("primary_key", False)
+            auto_increment = info.get("auto_increment", False)
+            unique = info.get("unique", False)
+            not_null = info.get("not_null", False)
+            _field = field + " " + info["type"]
+            if primary_key:
+                _field += " PRIMARY KEY"
+            if auto_increment:
+                _field += " AUTOINCREMENT"
+            if unique:
+                _field += " UNIQUE"
+            if not_null:
+                _field += " NOT NULL"
+            _fields.append(_field)
+        return "CREATE TABLE " + (table or cls._table) + " (" + ", ".join(_fields) + ")"
+
     @classmethod
     def _autocreate(cls):
         conn, cursor = connect()
         if isinstance(cls._fields, dict):
-            _fields = []
-            for field, info in cls._fields.items():
-                if "type" not in info:
-                    raise Exception("Missing type for field %s" % field)
-                primary_key = info.get("primary_key", False)
-                auto_increment = info.get("auto_increment", False)
-                unique = info.get("unique", False)
-                not_null = info.get("not_null", False)
-                _field = field + " " + info["type"]
-                if primary_key:
-                    _field += " PRIMARY KEY"
-                if auto_increment:
-                    _field += " AUTOINCREMENT"
-                if unique:
-                    _field += " UNIQUE"
-                if not_null:
-                    _field += " NOT NULL"
-                _fields.append(_field)
-            cursor.execute("CREATE TABLE " + cls._table + " (" + ", ".join(_fields) + ")")
+            cursor.execute(cls._create_sql())
+        cls._create_indexes(cursor)
+        close(conn, cursor)
+
+    @classmethod
+    def _create_indexes(cls, cursor):
+        for name, columns in (cls._indexes or {}).items():
+            cursor.execute("CREATE INDEX IF NOT EXISTS " + name + " ON " + cls._table + " (" + ", ".join(columns) + ")")
+
+    @classmethod
+    def _autoupgrade(cls, progress=None):
+        """
+        Create the table if it is missing, otherwise migrate it to the declared fields and
+        indexes. See muzak.db.migrations.
+        """
+        from muzak.db.migrations import migrate
+        return migrate(cls, progress=progress)
 
     # def _query(self, sql, *args):
     #     conn, cursor = connect()
@@ -209,49 +530,41 @@ class Model:
     #     return rows
 
     def delete(self):
-        sql = "DELETE FROM " + self._table + " WHERE "
-        _ands = []
         _vals = []
         for field in self._uniques:
-            if field in self._data:
-                _ands.append(field + " = ?")
-                _vals.append(self._data[field])
+            if self._has(field):
+                _vals.append(self[field])
             else:
                 raise AttributeError("No such attribute: %s" % field)
-        sql += " AND ".join(_ands)
+        sql = self._statement("delete", where=tuple(self._uniques))
         conn, cursor = connect()
         cursor.execute(sql, tuple(_vals))
         close(conn, cursor)
+        self._invalidate()
 
     def update(self, **kwargs):
-        sql = "UPDATE " + self._table + " SET "
-        _ands = []
         _vals = []
         for field in kwargs:
             if field in self._fields:
-                _ands.append(field + " = ?")
                 if field in self._json_fields:
                     _vals.append(json.dumps(kwargs[field]))
                 else:
                     _vals.append(kwargs[field])
             else:
                 raise AttributeError("No such attribute: %s" % field)
-        sql += ", ".join(_ands)
-        sql += " WHERE "
-        _ands = []
         for field in self._uniques:
-            if field in self._data:
-                _ands.append(field + " = ?")
-                _vals.append(self._data[field])
+            if self._has(field):
+                _vals.append(self[field])
             else:
                 raise AttributeError("No such attribute: %s" % field)
-        sql += " AND ".join(_ands)
+        sql = self._statement("update", tuple(kwargs), tuple(self._uniques))
         conn, cursor = connect()
         cursor.execute(sql, tuple(_vals))
         close(conn, cursor)
+        self._invalidate()
         for field in kwargs:
             if field in self._fields:
-                self._data[field] = kwargs[field]
+                self._set(field, kwargs[field])
 
     @classmethod
     def execute(cls, sql, *args):
@@ -282,44 +595,166 @@ class Model:
         return [cls(from_dict=row) for row in rows]
 
     @classmethod
-    def count(cls, **kwargs):
-        sql = "SELECT COUNT(*) FROM " + cls._table
-        if len(kwargs) > 0:
-            sql += " WHERE "
-        else:
-            conn, cursor = connect()
-            cursor.execute(sql)
-            row = cursor.fetchone()
+    def iter_execute(cls, sql, *args, batch_size=1000):
+        """
+        Like execute, but yields the rows as they are read from the cursor, batch_size at a
+        time, instead of loading them all first. The query stays open while the caller
+        iterates, so loops that write to the same table should page with iter_where instead.
+        """
+        conn, cursor = connect()
+        try:
+            cursor.execute(sql, args)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
             close(conn, cursor)
-            return list(row.values())[0]
+
+    @classmethod
+    def page(cls, cond=None, *args, limit=100, after_id=None, after=None, order_by="id", columns=None):
+        """
+        One page of up to limit rows matching cond, ordered by order_by and then id. Pass the
+        id (and order_by value, when ordering by another column) of the last row of a page
+        as after_id (and after) to get the next one. Unlike OFFSET, every page costs the
+        same, and rows written between pages don't shift it. NULL order_by values sort
+        first, as in ORDER BY.
+        """
+        if order_by not in cls._fields:
+            raise AttributeError("No such attribute: %s" % order_by)
+        columns = cls._page_columns(columns, order_by)
+        sql = "SELECT " + ", ".join(columns) + " FROM " + cls._table
         _ands = []
-        _vals = []
-        for field in kwargs:
-            _ands.append(field + " = %s")
-            _vals.append(kwargs[field])
-        sql += " AND ".join(_ands)
-        # conn, cursor = connect()
-        row = cls.execute(sql, tuple(_vals))[0]
-        # row = cursor.fetchone()
-        # close(conn, cursor)
-        return list(row.values())[0]
+        _vals = list(args)
+        if cond is not None:
+            _ands.append("(" + cond + ")")
+        if after_id is not None:
+            if order_by == "id":
+                _ands.append("id > ?")
+                _vals.append(after_id)
+            elif after is None:
+                # A row value comparison against NULL is never true, so spell out what
+                # follows a NULL key: the remaining NULLs by id, then every non-NULL value
+                _ands.append("((" + order_by + " IS NULL AND id > ?) OR " + order_by + " IS NOT NULL)")
+                _vals.append(after_id)
+            else:
+                _ands.append("(" + order_by + " > ? OR (" + order_by + " = ? AND id > ?))")
+                _vals.extend([after, after, after_id])
+        if len(_ands) > 0:
+            sql += " WHERE " + " AND ".join(_ands)
+        sql += " ORDER BY " + ("id" if order_by == "id" else order_by + ", id") + " LIMIT ?"
+        _vals.append(limit)
+        rows = cls.execute(sql, *_vals)
+        return [cls(from_dict=row) for row in rows]
 
     @classmethod
-    def exists(cls, **kwargs):
-        sql = "SELECT COUNT(*) FROM " + cls._table + " WHERE "
+    def _page_columns(cls, columns, order_by):
+        if columns is None:
+            return list(cls._fields)
+        columns = list(columns)
+        for field in ("id", order_by):
+            if field not in columns:
+                columns.append(field)
+        for field in columns:
+            if field not in cls._fields:
+                raise AttributeError("No such attribute: %s" % field)
+        return columns
+
+    @classmethod
+    def iter_where(cls, cond, *args, batch_size=1000, order_by="id", columns=None):
+        """
+        Yield every row matching cond, reading batch_size rows per query with page(). Only
+        the given columns are loaded when columns is set (id and order_by are always
+        included). Safe to use while updating or deleting the rows being iterated.
+        """
+        after_id = None
+        after = None
+        while True:
+            rows = cls.page(cond, *args, limit=batch_size, after_id=after_id, after=after, order_by=order_by, columns=columns)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1]["id"]
+            after = rows[-1][order_by]
+
+    @classmethod
+    def iter_all(cls, batch_size=1000, order_by="id", columns=None):
+        """
+        Yield every row, batch_size at a time. See iter_where.
+        """
+        return cls.iter_where(None, batch_size=batch_size, order_by=order_by, columns=columns)
+
+    @classmethod
+    def _filter(cls, kwargs):
+        """
+        A WHERE clause matching every field in kwargs by equality, and its values. None
+        matches NULL, and lists and dicts are compared in their stored JSON form.
+        """
+        if len(kwargs) == 0:
+            return "", []
         _ands = []
         _vals = []
-        for field in cls._uniques:
-            if field in kwargs:
-                _ands.append(field + " = %s")
-                _vals.append(kwargs[field])
-        sql += " AND ".join(_ands)
-        # conn, cursor = connect()
-        # cursor.execute(sql, tuple(_vals))
-        # row = cursor.fetchone()
-        # close(conn, cursor)
-        row = cls.execute(sql, tuple(_vals))[0]
-        return list(row.values())[0] > 0
+        for field, value in kwargs.items():
+            if field not in cls._fields:
+                raise AttributeError("No such attribute: %s" % field)
+            if value is None:
+                _ands.append(field + " IS NULL")
+            else:
+                _ands.append(field + " = ?")
+                _vals.append(json.dumps(value) if isinstance(value, (list, dict)) else value)
+        return " WHERE " + " AND ".join(_ands), _vals
+
+    @classmethod
+    def _decode(cls, field, value):
+        if field in cls._json_fields and isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    @classmethod
+    def column(cls, name, batch_size=1000, **kwargs):
+        """
+        Yield the value of one field for every row matching the keyword filters, without
+        building a Model object per row.
+        """
+        if name not in cls._fields:
+            raise AttributeError("No such attribute: %s" % name)
+        where, _vals = cls._filter(kwargs)
+        for row in cls.iter_execute("SELECT " + name + " FROM " + cls._table + where, *_vals, batch_size=batch_size):
+            yield cls._decode(name, row[0])
+
+    @classmethod
+    def distinct(cls, *columns, **kwargs):
+        """
+        The distinct values of the given fields among the rows matching the keyword filters.
+        With one field a list of values is returned, otherwise a list of tuples.
+        """
+        if len(columns) == 0:
+            raise ValueError("distinct needs at least one field")
+        for field in columns:
+            if field not in cls._fields:
+                raise AttributeError("No such attribute: %s" % field)
+        where, _vals = cls._filter(kwargs)
+        rows = cls.execute("SELECT DISTINCT " + ", ".join(columns) + " FROM " + cls._table + where, *_vals)
+        if len(columns) == 1:
+            return [cls._decode(columns[0], row[0]) for row in rows]
+        return [tuple(cls._decode(field, value) for field, value in zip(columns, row)) for row in rows]
+
+    @classmethod
+    def count(cls, **kwargs):
+        """
+        The number of rows matching the keyword filters.
+        """
+        where, _vals = cls._filter(kwargs)
+        return cls.execute("SELECT COUNT(*) FROM " + cls._table + where, *_vals)[0][0]
+
+    @classmethod
+    def exists(cls, **kwargs):
+        """
+        Whether any row matches the keyword filters. Stops at the first match.
+        """
+        where, _vals = cls._filter(kwargs)
+        return len(cls.execute("SELECT 1 FROM " + cls._table + where + " LIMIT 1", *_vals)) > 0
 
     @classmethod
     def all(cls):
@@ -331,10 +766,71 @@ class Model:
         return [cls(from_dict=row) for row in rows]
 
     @classmethod
-    def new(cls, **kwargs):
-        sql = "INSERT INTO " + cls._table + " (" + ", ".join(cls._fields) + ") VALUES (" + ", ".join(["?"] * len(cls._fields)) + ")"
+    def update_where(cls, filters: dict, **kwargs):
+        """
+        Set the given fields on every row matching filters, keyword filters as for count,
+        in one UPDATE. Returns the number of rows changed.
+        """
+        _vals = []
+        for field in kwargs:
+            if field not in cls._fields:
+                raise AttributeError("No such attribute: %s" % field)
+            if field in cls._json_fields:
+                _vals.append(json.dumps(kwargs[field]))
+            else:
+                _vals.append(kwargs[field])
+        where, _args = cls._filter(filters or {})
+        with transaction() as cursor:
+            cursor.execute(cls._statement("update", tuple(kwargs)) + where, tuple(_vals + _args))
+            count = cursor.rowcount
+        if cls._cache is not None:
+            cls._cache.clear()
+        return count
+
+    @classmethod
+    def delete_where(cls, **kwargs):
+        """
+        Delete every row matching the keyword filters in one DELETE, and return how many
+        were deleted. At least one filter is required.
+        """
+        if len(kwargs) == 0:
+            raise ValueError("delete_where needs at least one filter")
+        where, _vals = cls._filter(kwargs)
+        with transaction() as cursor:
+            cursor.execute(cls._statement("delete") + where, tuple(_vals))
+            count = cursor.rowcount
+        if cls._cache is not None:
+            cls._cache.clear()
+        return count
+
+    @classmethod
+    def delete_many(cls, ids):
+        """
+        Delete the rows with the given ids, ID_CHUNK per statement, in one transaction.
+        Returns the number of rows deleted.
+        """
+        ids = list(ids)
+        if not ids:
+            return 0
+        count = 0
+        with transaction() as cursor:
+            for i in range(0, len(ids), ID_CHUNK):
+                chunk = ids[i:i + ID_CHUNK]
+                cursor.execute(cls._statement("delete") + " WHERE id IN (" + ", ".join(["?"] * len(chunk)) + ")", tuple(chunk))
+                count += cursor.rowcount
+        if cls._cache is not None:
+            cls._cache.invalidate_many("id", ids)
+        return count
+
+    @classmethod
+    def _insert_columns(cls, kwargs):
+        # The supplied fields, plus the timestamps _insert_values fills in
+        return tuple(field for field in cls._names if field in kwargs or field in ("created_at", "updated_at"))
+
+    @classmethod
+    def _insert_values(cls, kwargs, columns=None):
         vals = []
-        for field in cls._fields:
+        for field in columns or cls._names:
             if field in kwargs:
                 if isinstance(kwargs[field], list):
                     vals.append(json.dumps(kwargs[field]))
@@ -348,15 +844,22 @@ class Model:
                 vals.append(datetime.now())
             else:
                 vals.append(None)
+        return tuple(vals)
+
+    @classmethod
+    def new(cls, **kwargs):
+        columns = cls._insert_columns(kwargs)
+        sql = cls._statement("insert", columns)
+        vals = cls._insert_values(kwargs, columns)
         conn, cursor = connect()
         try:
-            cursor.execute(sql, tuple(vals))
+            cursor.execute(sql, vals)
         except sqlite3.OperationalError as e:
             if "no such table" in str(e):
                 # Attempt to automatically create the table if we have enough information
                 if isinstance(cls._fields, dict):
                     cls._autocreate()
-                    cursor.execute(sql, tuple(vals))
+                    cursor.execute(sql, vals)
                 else:
                     raise e
             else:
@@ -373,7 +876,94 @@ class Model:
         close(conn, cursor)
         return cls(from_dict=kwargs)
 
+    @classmethod
+    def upsert(cls, **kwargs):
+        """
+        Insert a row, or update the one that already has the same value in the first unique
+        field other than id, and return it. On SQLite 3.35 and later this is a single
+        INSERT ... ON CONFLICT DO UPDATE ... RETURNING id. Older versions look the id up
+        afterwards, or before 3.24 try an UPDATE and INSERT when it matched nothing.
+        """
+        conflict = None
+        for field in cls._uniques:
+            if field != "id" and field in kwargs:
+                conflict = field
+                break
+        if conflict is None:
+            raise ValueError("upsert needs a value for one of %s" % ", ".join(f for f in cls._uniques if f != "id"))
+        columns = cls._insert_columns(kwargs)
+        vals = cls._insert_values(kwargs, columns)
+        if UPSERT and RETURNING:
+            conn, cursor = connect()
+            try:
+                row_id = cursor.execute(cls._statement("upsert", columns, (conflict,)), vals).fetchone()[0]
+            finally:
+                close(conn, cursor)
+        else:
+            with transaction() as cursor:
+                if UPSERT:
+                    cursor.execute(cls._statement("upsert", columns, (conflict,)), vals)
+                    row_id = cursor.execute("SELECT id FROM " + cls._table + " WHERE " + conflict + " = ?", (kwargs[conflict],)).fetchone()[0]
+                else:
+                    updates = tuple(field for field in columns if field not in (conflict, "id", "created_at")) or (conflict,)
+                    cursor.execute(cls._statement("update", updates, (conflict,)), tuple(vals[columns.index(field)] for field in updates) + (kwargs[conflict],))
+                    if cursor.rowcount == 0:
+                        cursor.execute(cls._statement("insert", columns), vals)
+                        row_id = cursor.lastrowid
+                    else:
+                        row_id = cursor.execute("SELECT id FROM " + cls._table + " WHERE " + conflict + " = ?", (kwargs[conflict],)).fetchone()[0]
+        if cls._cache is not None:
+            cls._cache.invalidate({"id": row_id, conflict: kwargs[conflict]})
+        kwargs["id"] = row_id
+        return cls(from_dict=kwargs)
+
+    @classmethod
+    def bulk_new(cls, rows, batch_size=500):
+        """
+        Insert every dict in rows and return the ids assigned to them, in order. Rows are
+        written with executemany, batch_size at a time, and each batch is committed once
+        instead of once per row. A batch that fails is rolled back as a whole and the error
+        re-raised; earlier batches stay committed. Inside an open transaction the rows are
+        written as part of it and nothing is committed here.
+        """
+        # Every column, since rows in one executemany can supply different fields
+        sql = cls._statement("insert", cls._names)
+        if isinstance(cls._fields, dict) and not table_exists(cls._table):
+            cls._autocreate()
+        ids = []
+        batch = []
+        for row in rows:
+            batch.append(cls._insert_values(row))
+            if len(batch) >= batch_size:
+                ids.extend(cls._insert_batch(sql, batch))
+                batch = []
+        if batch:
+            ids.extend(cls._insert_batch(sql, batch))
+        return ids
+
+    @classmethod
+    def _insert_batch(cls, sql, batch):
+        # BEGIN IMMEDIATE takes the write lock up front so nothing else can insert between our rows
+        with transaction() as cursor:
+            explicit = False
+            if "id" in cls._fields:
+                index = cls._index["id"]
+                explicit = any(vals[index] is not None for vals in batch)
+            if explicit:
+                # Explicit ids, so the assigned ones can't be worked out from the last
+                ids = []
+                for vals in batch:
+                    cursor.execute(sql, vals)
+                    ids.append(cursor.lastrowid)
+            else:
+                cursor.executemany(sql, batch)
+                last = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+                # New rowids are handed out one after another while we hold the write lock
+                ids = list(range(last - len(batch) + 1, last + 1))
+        return ids
+
 class SchemaModel(Model):
+    __slots__ = ()
     _table = "schema_history"
     _fields = {
         "id": {
@@ -0,0 +1,118 @@
+"""
+Per-process row cache for Model lookups by unique field.
+
+A Model with a cache enabled (Model.enable_cache) answers Model(id=...) and
+Model(path=...) from memory after the first lookup. Entries are keyed by every unique
+field of the row, so a row read by id is also found by path, and the least recently used
+row is dropped once the cache is full. Writes made through a Model invalidate its entry,
+but writes from other processes, or raw SQL, are not seen until the row is evicted or
+the cache cleared.
+"""
+from collections import OrderedDict
+import threading
+import weakref
+
+# Every cache in the process, cleared when a transaction rolls back
+_caches = weakref.WeakSet()
+
+
+def clear_all():
+    for cache in list(_caches):
+        cache.clear()
+
+
+class RowCache:
+    """
+    A bounded LRU of row values, reachable through any of the given unique fields.
+    """
+    def __init__(self, uniques: list, size: int = 4096):
+        self.uniques = list(uniques)
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._database = None
+        # Row key, a tuple of its unique values -> (values, pending JSON bits)
+        self._rows = OrderedDict()
+        # (field, value) -> row key
+        self._keys = {}
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def _check(self, database: str):
+        # Entries belong to one database file, a new DB_PATH starts over
+        if database != self._database:
+            self._rows.clear()
+            self._keys.clear()
+            self._database = database
+
+    def get(self, database: str, lookup: dict):
+        """
+        The cached (values, pending) of the row matching every field in lookup, or None.
+        """
+        with self._lock:
+            self._check(database)
+            key = None
+            for field, value in lookup.items():
+                found = self._keys.get((field, value))
+                if found is None or (key is not None and found != key):
+                    key = None
+                    break
+                key = found
+            if key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._rows.move_to_end(key)
+            return self._rows[key]
+
+    def put(self, database: str, key: tuple, values: list, pending: int):
+        with self._lock:
+            self._check(database)
+            if key in self._rows:
+                self._drop(key)
+            self._rows[key] = (values, pending)
+            for field, value in zip(self.uniques, key):
+                self._keys[(field, value)] = key
+            while len(self._rows) > self.size:
+                self._drop(next(iter(self._rows)))
+                self.evictions += 1
+
+    def invalidate(self, lookup: dict):
+        """
+        Drop the rows matching any field in lookup.
+        """
+        with self._lock:
+            for field, value in lookup.items():
+                key = self._keys.get((field, value))
+                if key is not None:
+                    self._drop(key)
+
+    def invalidate_many(self, field: str, values):
+        with self._lock:
+            for value in values:
+                key = self._keys.get((field, value))
+                if key is not None:
+                    self._drop(key)
+
+    def _drop(self, key: tuple):
+        del self._rows[key]
+        for field, value in zip(self.uniques, key):
+            if self._keys.get((field, value)) == key:
+                del self._keys[(field, value)]
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._keys.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "rows": len(self._rows),
+            "size": self.size
+        }
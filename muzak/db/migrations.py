@@ -0,0 +1,204 @@
+"""
+Schema migrations for Model tables.
+
+The declared schema of a model, its _fields and _indexes, is compared against the live
+table and the difference applied in one transaction. New columns and indexes are added in
+place. Anything ALTER TABLE can't do, such as dropping or retyping a column or adding a
+constraint to one, rebuilds the table by copying its rows over in chunks. Every schema a
+table is migrated to is recorded as a new version in schema_history, which is also how
+indexes that were dropped from the declaration are found and removed.
+"""
+import json
+
+from muzak.db import SchemaModel, checkout, table_exists, transaction
+
+CREATE = "create"
+ADD_COLUMN = "add_column"
+REBUILD = "rebuild"
+CREATE_INDEX = "create_index"
+DROP_INDEX = "drop_index"
+
+# Rows copied per statement during a rebuild, and between progress reports
+REBUILD_CHUNK = 10000
+
+
+def declared_schema(model) -> dict:
+    # Round-tripped so it compares equal to what schema_history hands back
+    return json.loads(json.dumps({
+        "fields": model._fields,
+        "indexes": model._indexes or {}
+    }))
+
+
+def _declared_column(info: dict) -> dict:
+    return {
+        "type": info["type"].upper(),
+        "primary_key": bool(info.get("primary_key", False)),
+        "unique": bool(info.get("unique", False)),
+        "not_null": bool(info.get("not_null", False))
+    }
+
+
+def live_columns(cursor, table: str) -> dict:
+    """
+    Columns of the live table in the same shape as _declared_column, by name.
+    """
+    columns = {}
+    for row in cursor.execute("PRAGMA table_info(" + table + ")").fetchall():
+        columns[row["name"]] = {
+            "type": row["type"].upper(),
+            "primary_key": row["pk"] > 0,
+            "unique": False,
+            "not_null": bool(row["notnull"])
+        }
+    for index in cursor.execute("PRAGMA index_list(" + table + ")").fetchall():
+        if index["origin"] != "u":
+            continue
+        names = [i["name"] for i in cursor.execute("PRAGMA index_info(" + index["name"] + ")").fetchall()]
+        if len(names) == 1 and names[0] in columns:
+            columns[names[0]]["unique"] = True
+    return columns
+
+
+def live_indexes(cursor, table: str) -> dict:
+    """
+    Indexes created with CREATE INDEX on the live table, name -> list of columns.
+    """
+    indexes = {}
+    for index in cursor.execute("PRAGMA index_list(" + table + ")").fetchall():
+        if index["origin"] == "c":
+            indexes[index["name"]] = [i["name"] for i in cursor.execute("PRAGMA index_info(" + index["name"] + ")").fetchall()]
+    return indexes
+
+
+def history(table: str) -> list:
+    """
+    Every recorded schema of the given table, oldest first.
+    """
+    if not table_exists(SchemaModel._table):
+        return []
+    return SchemaModel.where("table_name = ? ORDER BY id", table)
+
+
+def current_version(table: str) -> int:
+    """
+    The schema_history id of the schema the table was last migrated to, or None.
+    """
+    versions = history(table)
+    return versions[-1]["id"] if versions else None
+
+
+def _last_recorded(cursor, table: str) -> dict:
+    # Read through the migration's own cursor, which may hold the write lock
+    row = cursor.execute("SELECT schema FROM " + SchemaModel._table + " WHERE table_name = ? ORDER BY id DESC LIMIT 1", (table,)).fetchone()
+    return json.loads(row["schema"]) if row else None
+
+
+def plan(model, cursor) -> list:
+    """
+    The steps that bring the live table in line with the model, as (action, name) tuples.
+    """
+    table = model._table
+    live = live_columns(cursor, table)
+    if not live:
+        return [(CREATE, table)]
+    steps = []
+    rebuild = []
+    for field, info in model._fields.items():
+        declared = _declared_column(info)
+        if field not in live:
+            if declared["primary_key"] or declared["unique"] or declared["not_null"]:
+                # ALTER TABLE ADD COLUMN can't add constrained columns
+                rebuild.append("new constrained column %s" % field)
+            else:
+                steps.append((ADD_COLUMN, field))
+        elif live[field] != declared:
+            rebuild.append("column %s changed" % field)
+    for field in live:
+        if field not in model._fields:
+            rebuild.append("column %s dropped" % field)
+    if rebuild:
+        # The rebuild recreates every declared index, so no other step is needed
+        return [(REBUILD, ", ".join(rebuild))]
+    indexes = model._indexes or {}
+    existing = live_indexes(cursor, table)
+    for name, columns in indexes.items():
+        if name not in existing:
+            steps.append((CREATE_INDEX, name))
+        elif existing[name] != list(columns):
+            steps.append((DROP_INDEX, name))
+            steps.append((CREATE_INDEX, name))
+    recorded = _last_recorded(cursor, table)
+    if recorded:
+        for name in recorded.get("indexes", {}):
+            if name not in indexes and name in existing:
+                steps.append((DROP_INDEX, name))
+    return steps
+
+
+def _rebuild(model, cursor, progress=None):
+    table = model._table
+    temp = table + "__rebuild"
+    live = live_columns(cursor, table)
+    columns = ", ".join(field for field in model._fields if field in live)
+    total = cursor.execute("SELECT COUNT(*) FROM " + table).fetchone()[0]
+    sequence = None
+    if cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'").fetchone():
+        row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        sequence = row[0] if row else None
+    cursor.execute("DROP TABLE IF EXISTS " + temp)
+    cursor.execute(model._create_sql(temp))
+    done = 0
+    last = None
+    while done < total:
+        if last is None:
+            upper = cursor.execute("SELECT MAX(rowid) FROM (SELECT rowid FROM " + table + " ORDER BY rowid LIMIT ?)", (REBUILD_CHUNK,)).fetchone()[0]
+            cursor.execute("INSERT INTO " + temp + " (" + columns + ") SELECT " + columns + " FROM " + table + " WHERE rowid <= ? ORDER BY rowid", (upper,))
+        else:
+            upper = cursor.execute("SELECT MAX(rowid) FROM (SELECT rowid FROM " + table + " WHERE rowid > ? ORDER BY rowid LIMIT ?)", (last, REBUILD_CHUNK)).fetchone()[0]
+            cursor.execute("INSERT INTO " + temp + " (" + columns + ") SELECT " + columns + " FROM " + table + " WHERE rowid > ? AND rowid <= ? ORDER BY rowid", (last, upper))
+        done += cursor.rowcount
+        last = upper
+        if progress is not None:
+            progress(done, total)
+    cursor.execute("DROP TABLE " + table)
+    cursor.execute("ALTER TABLE " + temp + " RENAME TO " + table)
+    if sequence is not None:
+        # Keep AUTOINCREMENT from reusing the ids of rows deleted before the rebuild
+        cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?", (sequence, table, sequence))
+    model._create_indexes(cursor)
+
+
+def migrate(model, progress=None) -> list:
+    """
+    Migrate the model's table to its declared schema and return the steps that were
+    applied. progress, if given, is called with (rows copied, total rows) while a table is
+    rebuilt. Nothing is committed unless every step succeeds. A table that is already up to
+    date is checked without taking the write lock, so opening a database a scan is writing to
+    doesn't wait on it.
+    """
+    if not table_exists(SchemaModel._table):
+        SchemaModel._autocreate()
+    with checkout() as cursor:
+        current = not plan(model, cursor) and _last_recorded(cursor, model._table) == declared_schema(model)
+    if current:
+        return []
+    with transaction() as cursor:
+        steps = plan(model, cursor)
+        for action, name in steps:
+            if action == CREATE:
+                cursor.execute(model._create_sql())
+                model._create_indexes(cursor)
+            elif action == ADD_COLUMN:
+                cursor.execute("ALTER TABLE " + model._table + " ADD COLUMN " + name + " " + model._fields[name]["type"])
+            elif action == REBUILD:
+                _rebuild(model, cursor, progress=progress)
+            elif action == DROP_INDEX:
+                cursor.execute("DROP INDEX IF EXISTS " + name)
+            elif action == CREATE_INDEX:
+                columns = model._indexes[name]
+                cursor.execute("CREATE INDEX IF NOT EXISTS " + name + " ON " + model._table + " (" + ", ".join(columns) + ")")
+        schema = declared_schema(model)
+        if _last_recorded(cursor, model._table) != schema:
+            cursor.execute("INSERT INTO " + SchemaModel._table + " (table_name, schema) VALUES (?, ?)", (model._table, json.dumps(schema)))
+    return steps
@@ -1,7 +1,314 @@
-from muzak.db import Model, connect, close
+from muzak.db import Model, checkout, transaction
+import sqlite3
 import taglib
 
+# Names looked up per statement when resolving artist and genre ids
+NAME_CHUNK = 500
+
+
+class Artist(Model):
+    __slots__ = ()
+    _table = "artists"
+    _fields = {
+        "id": {
+            "type": "INTEGER",
+            "primary_key": True,
+            "auto_increment": True
+        },
+        "name": {
+            "type": "TEXT",
+            "unique": True,
+            "not_null": True
+        }
+    }
+    _uniques = [
+        "id",
+        "name"
+    ]
+    _json_fields = []
+
+
+class Genre(Artist):
+    __slots__ = ()
+    _table = "genres"
+
+
+class TrackArtist(Model):
+    __slots__ = ()
+    _table = "track_artists"
+    _fields = {
+        "track_id": {
+            "type": "INTEGER",
+            "not_null": True
+        },
+        "artist_id": {
+            "type": "INTEGER",
+            "not_null": True
+        },
+        "position": {
+            "type": "INTEGER"
+        }
+    }
+    _uniques = [
+        "track_id",
+        "artist_id"
+    ]
+    _json_fields = []
+    _indexes = {
+        "track_artists_track": ["track_id", "artist_id"],
+        "track_artists_artist": ["artist_id", "track_id"]
+    }
+
+
+class TrackGenre(Model):
+    __slots__ = ()
+    _table = "track_genres"
+    _fields = {
+        "track_id": {
+            "type": "INTEGER",
+            "not_null": True
+        },
+        "genre_id": {
+            "type": "INTEGER",
+            "not_null": True
+        },
+        "position": {
+            "type": "INTEGER"
+        }
+    }
+    _uniques = [
+        "track_id",
+        "genre_id"
+    ]
+    _json_fields = []
+    _indexes = {
+        "track_genres_track": ["track_id", "genre_id"],
+        "track_genres_genre": ["genre_id", "track_id"]
+    }
+
+
+# Track field -> (name model, link model, link column)
+NAME_LINKS = {
+    "artist": (Artist, TrackArtist, "artist_id"),
+    "genre": (Genre, TrackGenre, "genre_id")
+}
+
+
+def _names(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    names = []
+    for name in value:
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def _unlink(cursor, field: str, track_ids: list):
+    """
+    Remove the given tracks' links for field, and any names no other track uses anymore.
+    """
+    names, links, column = NAME_LINKS[field]
+    for i in range(0, len(track_ids), NAME_CHUNK):
+        chunk = track_ids[i:i + NAME_CHUNK]
+        marks = ", ".join(["?"] * len(chunk))
+        name_ids = [row[0] for row in cursor.execute("SELECT DISTINCT " + column + " FROM " + links._table + " WHERE track_id IN (" + marks + ")", chunk).fetchall()]
+        cursor.execute("DELETE FROM " + links._table + " WHERE track_id IN (" + marks + ")", chunk)
+        cursor.executemany("DELETE FROM " + names._table + " WHERE id = ? AND NOT EXISTS (SELECT 1 FROM " + links._table + " WHERE " + column + " = ?)", [(i, i) for i in name_ids])
+
+
+def _link(cursor, field: str, tracks: list):
+    """
+    Link each (track id, names) pair in tracks to its names, creating names that don't
+    exist yet.
+    """
+    names, links, column = NAME_LINKS[field]
+    tracks = [(track_id, _names(value)) for track_id, value in tracks]
+    wanted = sorted({name for _, values in tracks for name in values})
+    if not wanted:
+        return
+    cursor.executemany("INSERT OR IGNORE INTO " + names._table + " (name) VALUES (?)", [(name,) for name in wanted])
+    ids = {}
+    for i in range(0, len(wanted), NAME_CHUNK):
+        chunk = wanted[i:i + NAME_CHUNK]
+        for row in cursor.execute("SELECT id, name FROM " + names._table + " WHERE name IN (" + ", ".join(["?"] * len(chunk)) + ")", chunk).fetchall():
+            ids[row["name"]] = row["id"]
+    rows = []
+    for track_id, values in tracks:
+        for position, name in enumerate(values):
+            rows.append((track_id, ids[name], position))
+    cursor.executemany("INSERT INTO " + links._table + " (track_id, " + column + ", position) VALUES (?, ?, ?)", rows)
+
+
+# Full-text index over the searchable columns of tracks, rowid = track id. It keeps its
+# own copy of the text because artist is stored as JSON, which is flattened to plain
+# names on the way in.
+SEARCH_COLUMNS = ["title", "artist", "album", "album_artist"]
+FTS_TABLE = "tracks_fts"
+FTS_ARTIST = "CASE WHEN json_valid({row}.artist) THEN (SELECT group_concat(value, ' ') FROM json_each({row}.artist)) ELSE {row}.artist END"
+FTS_VALUES = "{row}.id, {row}.title, " + FTS_ARTIST + ", {row}.album, {row}.album_artist"
+FTS_TRIGGERS = ["tracks_fts_insert", "tracks_fts_delete", "tracks_fts_update"]
+FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS " + FTS_TABLE + " USING fts5(" + ", ".join(SEARCH_COLUMNS) + ")",
+    "CREATE TRIGGER IF NOT EXISTS tracks_fts_insert AFTER INSERT ON tracks BEGIN "
+    "INSERT INTO " + FTS_TABLE + " (rowid, " + ", ".join(SEARCH_COLUMNS) + ") VALUES (" + FTS_VALUES.format(row="NEW") + "); END",
+    "CREATE TRIGGER IF NOT EXISTS tracks_fts_delete AFTER DELETE ON tracks BEGIN "
+    "DELETE FROM " + FTS_TABLE + " WHERE rowid = OLD.id; END",
+    "CREATE TRIGGER IF NOT EXISTS tracks_fts_update AFTER UPDATE OF " + ", ".join(SEARCH_COLUMNS) + " ON tracks BEGIN "
+    "DELETE FROM " + FTS_TABLE + " WHERE rowid = OLD.id; "
+    "INSERT INTO " + FTS_TABLE + " (rowid, " + ", ".join(SEARCH_COLUMNS) + ") VALUES (" + FTS_VALUES.format(row="NEW") + "); END"
+]
+
+
+class Album(Model):
+    """
+    Per-album totals over tracks, keyed by album artist and album and kept up to date by
+    the triggers in SUMMARY_SCHEMA. track_id is the album's first track by id.
+    """
+    __slots__ = ()
+    _table = "albums"
+    _fields = {
+        "id": {
+            "type": "INTEGER",
+            "primary_key": True,
+            "auto_increment": True
+        },
+        "album_artist": {
+            "type": "TEXT"
+        },
+        "album": {
+            "type": "TEXT"
+        },
+        "track_count": {
+            "type": "INTEGER"
+        },
+        "duration": {
+            "type": "INTEGER"
+        },
+        "disc_count": {
+            "type": "INTEGER"
+        },
+        "year": {
+            "type": "INTEGER"
+        },
+        "track_id": {
+            "type": "INTEGER"
+        }
+    }
+    _uniques = [
+        "id"
+    ]
+    _json_fields = []
+    _indexes = {
+        "albums_album_artist_album": ["album_artist", "album"]
+    }
+
+
+class AlbumArtist(Model):
+    """
+    Per-album-artist totals, summed from albums by the same triggers.
+    """
+    __slots__ = ()
+    _table = "album_artists"
+    _fields = {
+        "id": {
+            "type": "INTEGER",
+            "primary_key": True,
+            "auto_increment": True
+        },
+        "album_artist": {
+            "type": "TEXT"
+        },
+        "track_count": {
+            "type": "INTEGER"
+        },
+        "album_count": {
+            "type": "INTEGER"
+        },
+        "duration": {
+            "type": "INTEGER"
+        },
+        "year": {
+            "type": "INTEGER"
+        },
+        "track_id": {
+            "type": "INTEGER"
+        }
+    }
+    _uniques = [
+        "id"
+    ]
+    _json_fields = []
+    _indexes = {
+        "album_artists_album_artist": ["album_artist"]
+    }
+
+
+# Trigger bodies keeping albums and album_artists in step with tracks. Album artist and
+# album can be NULL, so keys are matched with IS. Adding a track bumps its album's totals;
+# removing one takes them back down and only rescans the album's tracks when the track
+# held its earliest year, highest disc or first id. Artist rows are re-summed from albums.
+# Only integer durations, discs and years are counted: the scanner stores "Unknown" for
+# missing tags, and text would otherwise sort above every number.
+SUMMARY_FIELDS = ["album_artist", "album", "duration", "disc", "year"]
+ALBUM_KEY = "{table}.album_artist IS {row}.album_artist AND {table}.album IS {row}.album"
+DURATION = "(CASE WHEN typeof({row}.duration) = 'integer' THEN {row}.duration ELSE 0 END)"
+DISC = "(CASE WHEN typeof({row}.disc) = 'integer' THEN {row}.disc ELSE 1 END)"
+YEAR = "(CASE WHEN typeof({row}.year) = 'integer' THEN {row}.year END)"
+ALBUM_TOTALS = "COUNT(*), SUM(" + DURATION.format(row="tracks") + "), MAX(" + DISC.format(row="tracks") + "), MIN(" + YEAR.format(row="tracks") + "), MIN(tracks.id)"
+ALBUM_ADD = (
+    "UPDATE albums SET track_count = track_count + 1, duration = duration + " + DURATION + ", "
+    "disc_count = MAX(disc_count, " + DISC + "), "
+    "year = CASE WHEN year IS NULL OR " + YEAR + " < year THEN IFNULL(" + YEAR + ", year) ELSE year END, "
+    "track_id = MIN(track_id, {row}.id) WHERE " + ALBUM_KEY.format(table="albums", row="{row}") + "; "
+    "INSERT INTO albums (album_artist, album, track_count, duration, disc_count, year, track_id) "
+    "SELECT {row}.album_artist, {row}.album, 1, " + DURATION + ", " + DISC + ", " + YEAR + ", {row}.id "
+    "WHERE NOT EXISTS (SELECT 1 FROM albums WHERE " + ALBUM_KEY.format(table="albums", row="{row}") + "); "
+)
+ALBUM_REMOVE = (
+    "UPDATE albums SET track_count = track_count - 1, duration = duration - " + DURATION + " "
+    "WHERE " + ALBUM_KEY.format(table="albums", row="{row}") + "; "
+    "DELETE FROM albums WHERE " + ALBUM_KEY.format(table="albums", row="{row}") + " AND track_count <= 0; "
+    "UPDATE albums SET "
+    "disc_count = (SELECT IFNULL(MAX(" + DISC.format(row="tracks") + "), 1) FROM tracks WHERE " + ALBUM_KEY.format(table="tracks", row="{row}") + "), "
+    "year = (SELECT MIN(" + YEAR.format(row="tracks") + ") FROM tracks WHERE " + ALBUM_KEY.format(table="tracks", row="{row}") + "), "
+    "track_id = (SELECT MIN(id) FROM tracks WHERE " + ALBUM_KEY.format(table="tracks", row="{row}") + ") "
+    "WHERE " + ALBUM_KEY.format(table="albums", row="{row}") + " AND (track_id = {row}.id OR year = " + YEAR + " OR disc_count = " + DISC + "); "
+)
+ARTIST_TOTALS = "SUM(track_count), COUNT(*), SUM(duration), MIN(year), MIN(track_id) FROM albums WHERE albums.album_artist IS {row}.album_artist"
+ARTIST_SUM = (
+    "UPDATE album_artists SET (track_count, album_count, duration, year, track_id) = (SELECT " + ARTIST_TOTALS + ") "
+    "WHERE album_artist IS {row}.album_artist; "
+    "INSERT INTO album_artists (album_artist, track_count, album_count, duration, year, track_id) "
+    "SELECT album_artist, " + ARTIST_TOTALS + " AND NOT EXISTS (SELECT 1 FROM album_artists WHERE album_artists.album_artist IS {row}.album_artist) GROUP BY album_artist; "
+    "DELETE FROM album_artists WHERE album_artist IS {row}.album_artist AND NOT EXISTS (SELECT 1 FROM albums WHERE albums.album_artist IS {row}.album_artist); "
+)
+# Trigger name -> CREATE TRIGGER statement, compared against sqlite_master on every start
+SUMMARY_SCHEMA = {
+    "tracks_summary_insert": "CREATE TRIGGER tracks_summary_insert AFTER INSERT ON tracks BEGIN "
+    + ALBUM_ADD.format(row="NEW") + ARTIST_SUM.format(row="NEW") + "END",
+    "tracks_summary_delete": "CREATE TRIGGER tracks_summary_delete AFTER DELETE ON tracks BEGIN "
+    + ALBUM_REMOVE.format(row="OLD") + ARTIST_SUM.format(row="OLD") + "END",
+    "tracks_summary_update": "CREATE TRIGGER tracks_summary_update AFTER UPDATE OF " + ", ".join(SUMMARY_FIELDS) + " ON tracks BEGIN "
+    + ALBUM_REMOVE.format(row="OLD") + ARTIST_SUM.format(row="OLD") + ALBUM_ADD.format(row="NEW") + ARTIST_SUM.format(row="NEW") + "END"
+}
+
+
+def _match_expression(query: str) -> str:
+    """
+    Turn a free text query into an FTS5 expression where every word has to match the
+    start of a word in any column.
+    """
+    terms = []
+    for word in query.split():
+        terms.append('"' + word.replace('"', '""') + '"*')
+    return " ".join(terms)
+
+
 class Track(Model):
+    __slots__ = ()
     _table = "tracks"
     _fields = {
         "id": {
@@ -48,6 +355,18 @@ class Track(Model):
         "path": {
             "type": "TEXT",
             "unique": True
+        },
+        "size": {
+            "type": "INTEGER"
+        },
+        "mtime_ns": {
+            "type": "INTEGER"
+        },
+        "inode": {
+            "type": "INTEGER"
+        },
+        "device": {
+            "type": "INTEGER"
         }
     }
     _uniques = [
@@ -59,12 +378,229 @@ class Track(Model):
         "genre"
     ]
     _dt_fields = None
+    _indexes = {
+        # by_album() with an album artist, and the per-album rescans in the summary triggers
+        "tracks_album_artist_album": ["album_artist", "album", "disc", "track"],
+        # by_album() by album alone
+        "tracks_album": ["album", "disc", "track"],
+        "tracks_isrc": ["isrc"]
+    }
+
+    # Whether the full-text index is in use, decided by _setup_search
+    _fts = False
 
     def __str__(self):
         return f"<Track {self['path']}>"
-    
+
+    @classmethod
+    def _autoupgrade(cls, progress=None):
+        """
+        Migrate the tracks table and the artist and genre tables linked to it. When the
+        link tables are new, they are filled from the artist and genre of every track.
+        """
+        steps = super()._autoupgrade(progress=progress)
+        created = False
+        for model in (Artist, Genre, TrackArtist, TrackGenre):
+            for action, name in model._autoupgrade():
+                steps.append((action, name if action != "create" else model._table))
+                if action == "create" and model in (TrackArtist, TrackGenre):
+                    created = True
+        if created:
+            cls._backfill_names(progress=progress)
+        if cls._setup_search():
+            steps.append(("create", FTS_TABLE))
+        summaries = False
+        for model in (Album, AlbumArtist):
+            for action, name in model._autoupgrade():
+                steps.append((action, name if action != "create" else model._table))
+                if action == "create":
+                    summaries = True
+        cls._setup_summaries(rebuild=summaries)
+        return steps
+
+    @classmethod
+    def _setup_summaries(cls, rebuild: bool = False):
+        """
+        Create the triggers that maintain albums and album_artists, which table rebuilds
+        drop. Triggers from an older definition are replaced. Both tables are filled from
+        tracks when rebuild is set or any trigger had to be (re)created, since writes made
+        without it weren't counted. The write lock is only taken when something changes.
+        """
+        with checkout() as cursor:
+            live = {row[0]: row[1] for row in cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()}
+        if not rebuild and all(live.get(name) == sql for name, sql in SUMMARY_SCHEMA.items()):
+            return
+        with transaction() as cursor:
+            for name, sql in SUMMARY_SCHEMA.items():
+                row = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)).fetchone()
+                if row is None or row[0] != sql:
+                    cursor.execute("DROP TRIGGER IF EXISTS " + name)
+                    cursor.execute(sql)
+                    rebuild = True
+            if rebuild:
+                cls.rebuild_summaries()
+
+    @classmethod
+    def rebuild_summaries(cls):
+        """
+        Recompute albums and album_artists from every track.
+        """
+        with transaction() as cursor:
+            cursor.execute("DELETE FROM albums")
+            cursor.execute("INSERT INTO albums (album_artist, album, track_count, duration, disc_count, year, track_id) SELECT album_artist, album, " + ALBUM_TOTALS + " FROM tracks GROUP BY album_artist, album")
+            cursor.execute("DELETE FROM album_artists")
+            cursor.execute("INSERT INTO album_artists (album_artist, track_count, album_count, duration, year, track_id) SELECT album_artist, SUM(track_count), COUNT(*), SUM(duration), MIN(year), MIN(track_id) FROM albums GROUP BY album_artist")
+
+    @classmethod
+    def _setup_search(cls):
+        """
+        Create the full-text index and the triggers that keep it in sync, filling it from
+        every track when it is new. Table rebuilds drop the triggers, so they are recreated
+        on every start. Returns whether the index was created, and leaves Track._fts False
+        when SQLite was built without FTS5 or JSON support. The write lock is only taken when
+        the index or a trigger is missing.
+        """
+        wanted = [FTS_TABLE] + FTS_TRIGGERS
+        with checkout() as cursor:
+            found = cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name IN (" + ", ".join(["?"] * len(wanted)) + ")", tuple(wanted)).fetchone()[0]
+        if found == len(wanted):
+            cls._fts = True
+            return False
+        with transaction() as cursor:
+            exists = cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)).fetchone() is not None
+            try:
+                cursor.execute("SELECT json_valid('[]')")
+                cursor.execute(FTS_SCHEMA[0])
+            except sqlite3.OperationalError as e:
+                if "no such module" in str(e) or "no such function" in str(e):
+                    cls._fts = False
+                    return False
+                raise
+            for sql in FTS_SCHEMA[1:]:
+                cursor.execute(sql)
+            if not exists:
+                cursor.execute("INSERT INTO " + FTS_TABLE + " (rowid, " + ", ".join(SEARCH_COLUMNS) + ") SELECT " + FTS_VALUES.format(row="tracks") + " FROM tracks")
+        cls._fts = True
+        return not exists
+
+    @classmethod
+    def _backfill_names(cls, progress=None, batch_size=5000):
+        with checkout() as cursor:
+            total = cursor.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+        last = 0
+        done = 0
+        while done < total:
+            with checkout() as cursor:
+                rows = cursor.execute("SELECT id, artist, genre FROM tracks WHERE id > ? ORDER BY id LIMIT ?", (last, batch_size)).fetchall()
+            if not rows:
+                break
+            tracks = [cls(from_dict=row) for row in rows]
+            with transaction() as cursor:
+                for field in NAME_LINKS:
+                    _link(cursor, field, [(track["id"], track[field]) for track in tracks])
+            last = rows[-1]["id"]
+            done += len(rows)
+            if progress is not None:
+                progress(done, total)
+
+    @classmethod
+    def new(cls, **kwargs):
+        with transaction() as cursor:
+            track = super().new(**kwargs)
+            for field in NAME_LINKS:
+                _link(cursor, field, [(track["id"], kwargs.get(field))])
+        return track
+
+    @classmethod
+    def upsert(cls, **kwargs):
+        """
+        Insert the track, or update the one already at its path, and relink the artists
+        and genres given.
+        """
+        with transaction() as cursor:
+            track = super().upsert(**kwargs)
+            for field in NAME_LINKS:
+                if field in kwargs:
+                    _unlink(cursor, field, [track["id"]])
+                    _link(cursor, field, [(track["id"], kwargs[field])])
+        return track
+
+    @classmethod
+    def bulk_new(cls, rows, batch_size=500):
+        """
+        Insert every dict in rows and return the ids assigned to them, in order. Each batch
+        and its artist and genre links are written in one transaction.
+        """
+        ids = []
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                ids.extend(cls._bulk_new_batch(batch))
+                batch = []
+        if batch:
+            ids.extend(cls._bulk_new_batch(batch))
+        return ids
+
+    @classmethod
+    def _bulk_new_batch(cls, batch):
+        with transaction() as cursor:
+            ids = super().bulk_new(batch, batch_size=len(batch))
+            for field in NAME_LINKS:
+                _link(cursor, field, [(track_id, row.get(field)) for track_id, row in zip(ids, batch)])
+        return ids
+
+    def update(self, **kwargs):
+        with transaction() as cursor:
+            super().update(**kwargs)
+            for field in NAME_LINKS:
+                if field in kwargs:
+                    _unlink(cursor, field, [self["id"]])
+                    _link(cursor, field, [(self["id"], kwargs[field])])
+
+    def delete(self):
+        with transaction() as cursor:
+            super().delete()
+            for field in NAME_LINKS:
+                _unlink(cursor, field, [self["id"]])
+
+    @classmethod
+    def update_where(cls, filters: dict, **kwargs):
+        with transaction() as cursor:
+            relink = [field for field in NAME_LINKS if field in kwargs]
+            if relink:
+                # Matched before the update, which may change the filtered fields
+                ids = list(cls.column("id", **(filters or {})))
+            count = super().update_where(filters, **kwargs)
+            for field in relink:
+                _unlink(cursor, field, ids)
+                _link(cursor, field, [(track_id, kwargs[field]) for track_id in ids])
+        return count
+
+    @classmethod
+    def delete_where(cls, **kwargs):
+        with transaction() as cursor:
+            ids = list(cls.column("id", **kwargs))
+            for field in NAME_LINKS:
+                _unlink(cursor, field, ids)
+            return super().delete_where(**kwargs)
+
+    @classmethod
+    def delete_many(cls, ids):
+        ids = list(ids)
+        if not ids:
+            return 0
+        with transaction() as cursor:
+            for field in NAME_LINKS:
+                _unlink(cursor, field, ids)
+            return super().delete_many(ids)
+
     def __setitem__(self, key, value):
-        super().__setitem__(key, value)
+        with transaction() as cursor:
+            super().__setitem__(key, value)
+            if key in NAME_LINKS:
+                _unlink(cursor, key, [self["id"]])
+                _link(cursor, key, [(self["id"], value)])
         file_info = taglib.File(self["path"])
         if isinstance(value, list):
             file_info.tags[key.upper()] = value
@@ -73,13 +609,30 @@ class Track(Model):
         file_info.save()
 
     @classmethod
-    def search(cls, query: str):
+    def search(cls, query: str, limit: int = None):
         """
-        Search for tracks matching the given query.
+        Search for tracks matching every word of the given query, as a word prefix in the
+        title, artist, album or album artist. Results come best match first from the
+        full-text index, or in table order from a LIKE scan when the index isn't available.
         """
-        conn, cursor = connect()
-        cursor.execute("SELECT * FROM tracks WHERE title LIKE ? OR artist LIKE ? OR album LIKE ? OR album_artist LIKE ?", (f"%{query}%", f"%{query}%", f"%{query}%", f"%{query}%"))
-        rows = cursor.fetchall()
+        if not query.split():
+            return []
+        if cls._fts:
+            with checkout() as cursor:
+                cursor.execute("SELECT tracks.* FROM " + FTS_TABLE + " JOIN tracks ON tracks.id = " + FTS_TABLE + ".rowid WHERE " + FTS_TABLE + " MATCH ? ORDER BY bm25(" + FTS_TABLE + ") LIMIT ?", (_match_expression(query), limit if limit is not None else -1))
+                rows = cursor.fetchall()
+            return [cls(from_dict=dict(row)) for row in rows]
+        _ands = []
+        _vals = []
+        for word in query.split():
+            _ands.append("(" + " OR ".join(column + " LIKE ?" for column in SEARCH_COLUMNS) + ")")
+            _vals.extend([f"%{word}%"] * len(SEARCH_COLUMNS))
+        sql = "SELECT * FROM tracks WHERE " + " AND ".join(_ands)
+        if limit is not None:
+            sql += " LIMIT %d" % int(limit)
+        with checkout() as cursor:
+            cursor.execute(sql, tuple(_vals))
+            rows = cursor.fetchall()
         return [cls(from_dict=dict(row)) for row in rows]
 
     @classmethod
@@ -87,45 +640,61 @@ class Track(Model):
         """
         Get all artists.
         """
-        conn, cursor = connect()
-        cursor.execute("SELECT DISTINCT album_artist FROM tracks")
-        rows = cursor.fetchall()
-        return [row['album_artist'] for row in rows]
+        return [row[0] for row in AlbumArtist.execute("SELECT album_artist FROM album_artists ORDER BY album_artist")]
     
     @classmethod
     def albums(cls, artist: str = None):
         """
         Get all albums.
         """
-        conn, cursor = connect()
-        if artist is not None:
-            cursor.execute("SELECT DISTINCT album_artist, album FROM tracks WHERE artist = ?", (artist,))
-        else:
-            cursor.execute("SELECT DISTINCT album_artist, album FROM tracks")
-        rows = cursor.fetchall()
+        if artist is None:
+            return [(row[0], row[1]) for row in Album.execute("SELECT album_artist, album FROM albums ORDER BY album_artist, album")]
+        with checkout() as cursor:
+            cursor.execute("SELECT DISTINCT tracks.album_artist, tracks.album FROM artists JOIN track_artists ON track_artists.artist_id = artists.id JOIN tracks ON tracks.id = track_artists.track_id WHERE artists.name = ?", (artist,))
+            rows = cursor.fetchall()
         return [(row['album_artist'], row['album']) for row in rows]
 
     @classmethod
     def by_artist(cls, artist: str):
         """
-        Get all tracks by the given artist.
+        Get all tracks the given artist appears on.
+        """
+        with checkout() as cursor:
+            cursor.execute("SELECT tracks.* FROM artists JOIN track_artists ON track_artists.artist_id = artists.id JOIN tracks ON tracks.id = track_artists.track_id WHERE artists.name = ?", (artist,))
+            rows = cursor.fetchall()
+        return [cls(from_dict=dict(row)) for row in rows]
+
+    @classmethod
+    def by_genre(cls, genre: str):
+        """
+        Get all tracks tagged with the given genre.
         """
-        conn, cursor = connect()
-        cursor.execute("SELECT * FROM tracks WHERE artist = ?", (artist,))
-        rows = cursor.fetchall()
+        with checkout() as cursor:
+            cursor.execute("SELECT tracks.* FROM genres JOIN track_genres ON track_genres.genre_id = genres.id JOIN tracks ON tracks.id = track_genres.track_id WHERE genres.name = ?", (genre,))
+            rows = cursor.fetchall()
         return [cls(from_dict=dict(row)) for row in rows]
+
+    @classmethod
+    def genres(cls):
+        """
+        Get all genres.
+        """
+        with checkout() as cursor:
+            cursor.execute("SELECT name FROM genres ORDER BY name")
+            rows = cursor.fetchall()
+        return [row['name'] for row in rows]
     
     @classmethod
     def by_album(cls, album: str, album_artist: str = None):
         """
         Get all tracks on the given album.
         """
-        conn, cursor = connect()
-        if album_artist is not None:
-            cursor.execute("SELECT * FROM tracks WHERE album = ? AND album_artist = ?", (album, album_artist))
-        else:
-            cursor.execute("SELECT * FROM tracks WHERE album = ?", (album,))
-        rows = cursor.fetchall()
+        with checkout() as cursor:
+            if album_artist is not None:
+                cursor.execute("SELECT * FROM tracks WHERE album = ? AND album_artist = ?", (album, album_artist))
+            else:
+                cursor.execute("SELECT * FROM tracks WHERE album = ?", (album,))
+            rows = cursor.fetchall()
         return [cls(from_dict=dict(row)) for row in rows]
     
     @classmethod
@@ -133,7 +702,7 @@ class Track(Model):
         """
         Get all tracks without an ISRC.
         """
-        conn, cursor = connect()
-        cursor.execute("SELECT * FROM tracks WHERE isrc = 'Unknown'")
-        rows = cursor.fetchall()
+        with checkout() as cursor:
+            cursor.execute("SELECT * FROM tracks WHERE isrc = 'Unknown'")
+            rows = cursor.fetchall()
         return [cls(from_dict=dict(row)) for row in rows]
\ No newline at end of file
@@ -0,0 +1,227 @@
+"""
+Header-only tag reader for MP3 (ID3v2), FLAC and Ogg Vorbis/Opus files.
+
+Only the tag block at the start of the file is read, frames and metadata blocks that
+aren't wanted (cover art, padding, seek tables) are skipped with seek() instead of
+being read, and only the requested keys are decoded. Tags are returned in the same
+shape as taglib.File.tags, an uppercase key mapped to a list of strings. Anything the
+reader can't handle exactly the way taglib would returns None, so the caller can fall
+back to taglib.
+"""
+import struct
+from typing import Dict, List, Optional, Set
+
+READ_BUFFER = 16 * 1024
+MAX_COMMENT_BYTES = 1024 * 1024
+
+ID3_FRAMES = {
+    b"TIT2": "TITLE",
+    b"TPE1": "ARTIST",
+    b"TALB": "ALBUM",
+    b"TPE2": "ALBUMARTIST",
+    b"TRCK": "TRACKNUMBER",
+    b"TPOS": "DISCNUMBER",
+    b"TCON": "GENRE",
+    b"TDRC": "DATE",
+    b"TYER": "DATE",
+    b"TLEN": "LENGTH",
+    b"TSRC": "ISRC"
+}
+
+ID3_ENCODINGS = {
+    0: "latin-1",
+    1: "utf-16",
+    2: "utf-16-be",
+    3: "utf-8"
+}
+
+
+class UnsupportedTag(Exception):
+    pass
+
+
+def read_tags(path: str, keys: Set[str] = None) -> Optional[Dict[str, List[str]]]:
+    """
+    Read the tags of the given file, limited to the given uppercase keys when keys is not
+    None. Returns None when the file should be read by taglib instead.
+    """
+    extension = str(path).lower().rsplit(".", 1)[-1]
+    with open(path, "rb", buffering=READ_BUFFER) as f:
+        magic = f.read(4)
+        f.seek(0)
+        try:
+            # taglib picks the format from the extension, so both have to agree
+            if magic[:3] == b"ID3" and extension == "mp3":
+                tags = _read_id3v2(f, keys)
+            elif magic == b"fLaC" and extension == "flac":
+                tags = _read_flac(f, keys)
+            elif magic == b"OggS" and extension == "ogg":
+                tags = _read_ogg(f, keys)
+            else:
+                return None
+        except (UnsupportedTag, struct.error, ValueError, IndexError, UnicodeDecodeError):
+            return None
+    if not tags:
+        # taglib may still find something in an ID3v1 or APE tag
+        return None
+    return tags
+
+
+def _read_exact(f, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise UnsupportedTag("Unexpected end of file")
+    return data
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _decode_id3_text(data: bytes) -> List[str]:
+    encoding = ID3_ENCODINGS.get(data[0])
+    if encoding is None:
+        raise UnsupportedTag("Unknown ID3 text encoding")
+    text = data[1:].decode(encoding)
+    # UTF-16 strings after the first carry their own byte order mark
+    return [i.lstrip("\ufeff") for i in text.rstrip("\x00").split("\x00")]
+
+
+def _read_id3v2(f, keys: Set[str]) -> Dict[str, List[str]]:
+    header = _read_exact(f, 10)
+    version = header[3]
+    flags = header[5]
+    if version not in (3, 4):
+        raise UnsupportedTag("Unsupported ID3v2 version")
+    if flags & 0x80:
+        raise UnsupportedTag("Unsynchronised ID3v2 tag")
+    end = 10 + _syncsafe(header[6:10])
+    if flags & 0x40:
+        size = _read_exact(f, 4)
+        if version == 4:
+            f.seek(_syncsafe(size) - 4, 1)
+        else:
+            f.seek(struct.unpack(">I", size)[0], 1)
+    tags = {}
+    dates = 0
+    while f.tell() + 10 <= end:
+        frame = _read_exact(f, 10)
+        frame_id = frame[:4]
+        if frame_id[0] == 0:
+            # Padding
+            break
+        if version == 4:
+            size = _syncsafe(frame[4:8])
+            unsupported_flags = 0x4f
+        else:
+            size = struct.unpack(">I", frame[4:8])[0]
+            unsupported_flags = 0xe0
+        if frame_id == b"TDAT" or frame_id == b"TIME":
+            # taglib folds these into DATE on ID3v2.3 tags
+            raise UnsupportedTag("ID3v2.3 date frames")
+        key = ID3_FRAMES.get(frame_id)
+        if key is None and frame_id != b"TXXX":
+            f.seek(size, 1)
+            continue
+        if key is not None and keys is not None and key not in keys:
+            f.seek(size, 1)
+            continue
+        if frame[9] & unsupported_flags:
+            raise UnsupportedTag("Compressed, encrypted or grouped ID3v2 frame")
+        values = _decode_id3_text(_read_exact(f, size))
+        if frame_id == b"TXXX":
+            if len(values) < 2:
+                continue
+            key = values[0].upper()
+            values = values[1:]
+            if keys is not None and key not in keys:
+                continue
+        elif frame_id == b"TCON":
+            for value in values:
+                if value.isdigit() or value.startswith("("):
+                    raise UnsupportedTag("ID3v1 genre reference")
+        if key == "DATE":
+            dates += 1
+            if dates > 1:
+                raise UnsupportedTag("Multiple date frames")
+        tags.setdefault(key, []).extend(values)
+    return tags
+
+
+def _parse_vorbis_comment(data: bytes, keys: Set[str]) -> Dict[str, List[str]]:
+    vendor_length = struct.unpack_from("<I", data, 0)[0]
+    offset = 4 + vendor_length
+    count = struct.unpack_from("<I", data, offset)[0]
+    offset += 4
+    tags = {}
+    for _ in range(count):
+        length = struct.unpack_from("<I", data, offset)[0]
+        offset += 4
+        comment = data[offset:offset + length]
+        if len(comment) != length:
+            raise UnsupportedTag("Truncated Vorbis comment")
+        offset += length
+        key, sep, value = comment.partition(b"=")
+        if not sep:
+            continue
+        key = key.decode("ascii").upper()
+        if keys is not None and key not in keys:
+            continue
+        tags.setdefault(key, []).append(value.decode("utf-8"))
+    return tags
+
+
+def _read_flac(f, keys: Set[str]) -> Dict[str, List[str]]:
+    f.seek(4)
+    while True:
+        header = _read_exact(f, 4)
+        last = header[0] & 0x80
+        block_type = header[0] & 0x7f
+        size = int.from_bytes(header[1:4], "big")
+        if block_type == 4:
+            return _parse_vorbis_comment(_read_exact(f, size), keys)
+        if last:
+            return {}
+        f.seek(size, 1)
+
+
+def _read_ogg(f, keys: Set[str]) -> Dict[str, List[str]]:
+    """
+    Reassemble the second packet of the first logical stream, which holds the comment
+    header for Vorbis and Opus.
+    """
+    packets = []
+    current = b""
+    serial = None
+    read = 0
+    while len(packets) < 2:
+        header = _read_exact(f, 27)
+        if header[:4] != b"OggS":
+            raise UnsupportedTag("Lost Ogg page sync")
+        page_serial = struct.unpack_from("<I", header, 14)[0]
+        segments = _read_exact(f, header[26])
+        body_size = sum(segments)
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial:
+            f.seek(body_size, 1)
+            continue
+        body = _read_exact(f, body_size)
+        read += body_size
+        if read > MAX_COMMENT_BYTES:
+            raise UnsupportedTag("Ogg comment header too large")
+        offset = 0
+        for lacing in segments:
+            current += body[offset:offset + lacing]
+            offset += lacing
+            if lacing < 255:
+                packets.append(current)
+                current = b""
+                if len(packets) == 2:
+                    break
+    ident, comment = packets
+    if ident.startswith(b"\x01vorbis") and comment.startswith(b"\x03vorbis"):
+        return _parse_vorbis_comment(comment[7:], keys)
+    if ident.startswith(b"OpusHead") and comment.startswith(b"OpusTags"):
+        return _parse_vorbis_comment(comment[8:], keys)
+    raise UnsupportedTag("Unsupported Ogg codec")
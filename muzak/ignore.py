@@ -0,0 +1,206 @@
+import os
+import re
+from typing import Iterable, Optional, Tuple
+
+IGNORE_FILENAME = ".muzakignore"
+GLOB_CHARS = "*?[\\"
+
+
+def _translate(pattern: str) -> str:
+    """
+    Translate a gitignore-style glob into a regular expression fragment.
+    """
+    i = 0
+    n = len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**/", i):
+                # "**/" matches zero or more leading directories
+                out.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern.startswith("**", i):
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 2)
+            if j == -1:
+                out.append("\\[")
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append("[" + body.replace("\\", "\\\\") + "]")
+                i = j + 1
+                continue
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class IgnoreMatcher:
+    """
+    Compiled set of gitignore-style exclusion rules for a scan root.
+
+    Rules are matched against paths relative to the root, using "/" as the separator.
+    Literal paths are kept in a prefix trie of path components that a walker carries
+    down the tree, literal names and excluded files are kept in sets, and glob patterns
+    are combined into a single regular expression. Negated ("!") patterns are not
+    supported and are skipped.
+    """
+    def __init__(self, root: str, patterns: Iterable[str] = None, exclude_files: Iterable[str] = None):
+        """
+        :param root: The directory being scanned.
+        :param patterns: Patterns relative to root, or absolute directory paths.
+        :param exclude_files: Exact file paths to exclude, as produced by the walk.
+        """
+        self.root = str(root)
+        self._root_abs = os.path.abspath(self.root)
+        self.files = set(exclude_files or [])
+        self.trie = {}
+        self.paths = set()
+        self.names = set()
+        self.dir_names = set()
+        self._rules = []
+        self._dir_rules = []
+        self._any_regex = None
+        self._dir_regex = None
+        for pattern in patterns or []:
+            self.add_pattern(pattern)
+
+    def add_pattern(self, pattern: str, base: str = ""):
+        """
+        Add a single pattern. base is the root-relative directory of the ignore file the
+        pattern came from, and anchors the pattern there.
+        """
+        pattern = str(pattern)
+        if os.path.isabs(pattern):
+            self._add_abspath(pattern)
+            return
+        self._add_rule(pattern, base)
+
+    def _add_rule(self, pattern: str, base: str = ""):
+        # A leading "/" anchors the pattern to base, it's never an absolute path here
+        pattern = pattern.rstrip("\n").rstrip(" ")
+        if not pattern or pattern.startswith("#") or pattern.startswith("!"):
+            return
+        if pattern.startswith("\\#") or pattern.startswith("\\!"):
+            pattern = pattern[1:]
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        if not pattern:
+            return
+        literal = not any(c in pattern for c in GLOB_CHARS)
+        if literal and anchored and not base:
+            self._add_literal(pattern, dir_only)
+        elif literal and not base:
+            if dir_only:
+                self.dir_names.add(pattern)
+            else:
+                self.names.add(pattern)
+        else:
+            # Patterns from nested ignore files are loaded after the walker has passed the
+            # trie nodes above them, so they are matched by regex instead
+            prefix = re.escape(base) + "/" if base else ""
+            if not anchored:
+                prefix += "(?:.*/)?"
+            rule = prefix + _translate(pattern)
+            if dir_only:
+                self._dir_rules.append(rule)
+            else:
+                self._rules.append(rule)
+            self._any_regex = None
+            self._dir_regex = None
+
+    def load(self, path: str, base: str = ""):
+        """
+        Load patterns from an ignore file.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._add_rule(line, base=base)
+        except OSError:
+            pass
+
+    def _add_abspath(self, path: str):
+        path = os.path.abspath(path)
+        if self._root_abs == path or self._root_abs.startswith(path.rstrip(os.sep) + os.sep):
+            # The whole scan root is excluded
+            self.trie[None] = True
+            return
+        rel = os.path.relpath(path, self._root_abs)
+        if rel.startswith(".."):
+            return
+        self._add_literal(rel.replace(os.sep, "/"), False)
+
+    def _add_literal(self, rel: str, dir_only: bool):
+        node = self.trie
+        for part in rel.split("/"):
+            node = node.setdefault(part, {})
+        node[None] = True
+        if not dir_only:
+            self.paths.add(rel)
+
+    def _compile(self):
+        if self._any_regex is None:
+            self._any_regex = re.compile("^(?:" + "|".join(self._rules) + ")$") if self._rules else False
+            self._dir_regex = re.compile("^(?:" + "|".join(self._dir_rules) + ")$") if self._dir_rules else False
+
+    def enter(self, node: Optional[dict], rel: str, name: str) -> Tuple[bool, Optional[dict]]:
+        """
+        Check a subdirectory during a walk. node is the trie node of its parent. Returns
+        whether the directory is excluded, and the trie node to carry into it.
+        """
+        child = None
+        if node is not None:
+            child = node.get(name)
+            if child is not None and None in child:
+                return True, None
+        if name in self.names or name in self.dir_names:
+            return True, None
+        self._compile()
+        if self._any_regex and self._any_regex.match(rel):
+            return True, None
+        if self._dir_regex and self._dir_regex.match(rel):
+            return True, None
+        return False, child
+
+    def match_file(self, path: str, rel: str, name: str) -> bool:
+        """
+        Check whether a file found during a walk is excluded. Its directories are assumed
+        to have been checked already.
+        """
+        if path in self.files or name in self.names or rel in self.paths:
+            return True
+        self._compile()
+        return bool(self._any_regex and self._any_regex.match(rel))
+
+    def ignored(self, rel: str, is_dir: bool = False) -> bool:
+        """
+        Check an arbitrary root-relative path, including all of its parent directories.
+        """
+        if None in self.trie:
+            return True
+        parts = rel.split("/")
+        node = self.trie
+        for i in range(len(parts) - 1):
+            excluded, node = self.enter(node, "/".join(parts[:i + 1]), parts[i])
+            if excluded:
+                return True
+        if is_dir:
+            return self.enter(node, rel, parts[-1])[0]
+        return self.match_file(os.path.join(self.root, *parts), rel, parts[-1])
@@ -1,18 +1,29 @@
 import os
 from clilib.config.config_loader import JSONConfigurationFile
 from clilib.util.logging import Logging
-from muzak.db.models import Track
+from muzak.db.models import Album, AlbumArtist, Track
 # from muzak.db import connect, close
-from muzak.scanner import TAG_FIELDS, Scanner
+from muzak.stats import Stats
+from muzak.scanner import COUNTERS, FINGERPRINT_FIELDS, TAG_FIELDS, Scanner, fingerprint
 from pathlib import Path
 from muzak import db
+from muzak.db import NoSuchRowError, transaction
 import shutil
+import sqlite3
 import re
+from typing import Iterable
 
 from muzak.tools import update_trackinfo
 
 
 class Library:
+    # Seconds between progress lines during long imports
+    progress_interval = 10
+    # Tracks add_tracks inserts per transaction
+    insert_batch_size = 500
+    # Rows kept in memory for lookups by id and path while watching
+    row_cache_size = 4096
+
     def __init__(self, path: str, create: bool = False, debug: bool = False):
         self.path = Path(path)
         if create:
@@ -26,10 +37,18 @@ class Library:
         db.DB_PATH = self.db_path
         self.library_config = JSONConfigurationFile(self.path / "muzak.json", schema={
             "filename_format": str,
-            "network_share": bool
+            "network_share": bool,
+            "inboxes": list,
+            "performance": {
+                # Optional, a block with only PRAGMA overrides uses the default profile
+                "profile": (str, type(None))
+            }
         }, auto_create={
             "filename_format": "{album_artist}/{album}/{title} [{isrc}]",
-            "network_share": False
+            "network_share": False,
+            "performance": {
+                "profile": "default"
+            }
         })
         # if self.library_config["network_share"]:
         #     home_path = Path.home()
@@ -46,8 +65,23 @@ class Library:
         #                 shutil.copyfile(db.DB_PATH, local_db_path)
         #     db.DB_PATH = local_db_path
         self.logger = Logging("Library", str(self.path.stem), debug=debug).get_logger()
+        # SQLite tuning, a profile from muzak.db.PROFILES plus optional PRAGMA overrides
+        performance = dict(self.library_config["performance"] or {})
+        if performance.get("profile") is None:
+            performance["profile"] = "default"
+        db.configure(**performance)
+        steps = Track._autoupgrade(progress=self._migration_progress)
+        for action, name in steps:
+            if action != "create":
+                self.logger.info(f"Migrated tracks table: {action} {name}")
+        self.stats = Stats()
+        self._pending = {}
+        self._failed_inserts = []
         # self.db = create_or_open(self.db_path)
 
+    def _migration_progress(self, done: int, total: int):
+        self.logger.info(f"Migrating tracks: {done}/{total} rows")
+
     def _remove_empty_dirs(self, path: str):
         """
         Remove empty directories from the given path.
@@ -99,91 +133,284 @@ class Library:
     def albums(self, artist: str = None):
         return Track.albums(artist=artist)
 
+    def album_summaries(self, album_artist: str = None):
+        """
+        Albums with their track count, total duration, disc count, earliest year and first
+        track, optionally only those by the given album artist.
+        """
+        if album_artist is not None:
+            return Album.where("album_artist = ? ORDER BY album", album_artist)
+        return Album.where("1 ORDER BY album_artist, album")
+
+    def totals(self) -> dict:
+        """
+        Track, album artist and album counts and the total duration, from the summary tables.
+        """
+        row = AlbumArtist.execute("SELECT IFNULL(SUM(track_count), 0), COUNT(*), IFNULL(SUM(album_count), 0), IFNULL(SUM(duration), 0) FROM album_artists")[0]
+        return {
+            "tracks": row[0],
+            "artists": row[1],
+            "albums": row[2],
+            "duration": row[3]
+        }
+
+    def rebuild_summaries(self):
+        """
+        Recompute the album and album artist summary tables from the tracks table.
+        """
+        Track.rebuild_summaries()
+        self.logger.info("Rebuilt summaries for {albums} albums by {artists} album artists".format(**self.totals()))
+
     def get(self, **kwargs):
         if len(kwargs) == 0:
             return Track.all()
         return Track(**kwargs)
 
-    def add_track(self, track: str, move: bool = False, **kwargs):
+    def add_track(self, track: str, move: bool = False, track_info: dict = None, defer: bool = False, replace: Track = None, **kwargs):
+        """
+        Copy or move a file into the library and record it. replace is the existing record
+        of a file whose contents changed, which is updated in place, keeping its id, rather
+        than a new row being added.
+        """
         # try:
         #     track_info = Scanner.scan_file(track)
         # except OSError:
         #     self.logger.warning(f"Unable to scan [{track}]")
         #     return None
-        track_info = Scanner.scan_file(track)
+        if track_info is None:
+            track_info = Scanner.scan_file(track)
         for k, v in kwargs.items():
             if k in track_info:
                 if k in TAG_FIELDS and isinstance(v, TAG_FIELDS[k]["type"]):
                     track_info[k] = v
-        sanitized = self._sanitize_trackinfo(track_info)
-        track_info["title"] = sanitized["title"]
-        track_filename = self._build_filename(sanitized)
+        with self.stats.time("filenames"):
+            sanitized = self._sanitize_trackinfo(track_info)
+            track_info["title"] = sanitized["title"]
+            track_filename = self._build_filename(sanitized)
         track_path = self.path / track_filename
+        copied = False
         if track_path.exists():
-            try:
-                exist = Track(path=str(track_path))
-            except Exception:
-                pass
-            else:
-                self.logger.warning(f"Scanner found duplicate track [{track}] -> [{track_path}]")
-                if move:
-                    Path(track).unlink()
-                return exist
+            if str(track_path) in self._pending:
+                self._flush_inserts()
+            # A file already in place, e.g. one the scan moved earlier in the same walk, is
+            # upserted below. Only a different file at the target needs the row looked up.
+            if not track_path.samefile(track):
+                try:
+                    exist = Track(path=str(track_path))
+                except NoSuchRowError:
+                    pass
+                else:
+                    self.logger.warning(f"Scanner found duplicate track [{track}] -> [{track_path}]")
+                    self.stats.add("duplicates")
+                    if move:
+                        Path(track).unlink()
+                        if replace is not None:
+                            replace.delete()
+                    return exist
         else:
             if not track_path.parent.exists():
                 track_path.parent.mkdir(parents=True, exist_ok=True)
-            if move:
-                self.logger.info(f"Moving track [{track}] -> [{track_path}]")
-                shutil.copyfile(track, track_path)
-                Path(track).unlink()
-            else:
-                self.logger.info(f"Copying track [{track}] -> [{track_path}]")
-                shutil.copyfile(track, track_path)
+            with self.stats.time("copy"):
+                if move:
+                    self.logger.info(f"Moving track [{track}] -> [{track_path}]")
+                    shutil.copyfile(track, track_path)
+                    Path(track).unlink()
+                else:
+                    self.logger.info(f"Copying track [{track}] -> [{track_path}]")
+                    shutil.copyfile(track, track_path)
+            copied = True
         self.logger.info(f"Adding track [{track_path}] to database ...")
         track_info["path"] = str(track_path)
-        return Track.new(**track_info)
+        track_info.update(fingerprint(track_path.stat()))
+        if copied:
+            self.stats.add("bytes_copied", track_info["size"])
+        if replace is not None:
+            with self.stats.time("db_insert"):
+                replace.update(**{k: v for k, v in track_info.items() if k in Track._fields and k != "id"})
+            self.stats.add("updated")
+            return replace
+        if defer and copied:
+            # Inserted with the rest of the batch by _flush_inserts
+            self._pending[track_info["path"]] = (track, track_info)
+            if len(self._pending) >= self.insert_batch_size:
+                self._flush_inserts()
+            return None
+        with self.stats.time("db_insert"):
+            track = Track.upsert(**track_info)
+        self.stats.add("added")
+        return track
+
+    def _flush_inserts(self):
+        """
+        Insert the tracks add_track deferred in one transaction. If that fails, they are
+        upserted one at a time so a bad row only loses itself, and a stale row left at the
+        same path is replaced.
+        """
+        if not self._pending:
+            return
+        pending = list(self._pending.values())
+        self._pending = {}
+        try:
+            with self.stats.time("db_insert", rows=len(pending)):
+                Track.bulk_new((info for _, info in pending), batch_size=len(pending))
+            self.stats.add("added", len(pending))
+        except sqlite3.Error as e:
+            self.logger.warning(f"Batch insert failed ({e}), inserting {len(pending)} tracks one at a time")
+            for track, info in pending:
+                try:
+                    Track.upsert(**info)
+                    self.stats.add("added")
+                except sqlite3.Error as e:
+                    self.logger.warning(f"Failed to add {track}: {e}")
+                    self.stats.error(e)
+                    self._failed_inserts.append(track)
 
-    def add_tracks(self, files: list, move: bool = False):
+    def add_tracks(self, files: Iterable[str], move: bool = False, jobs: int = 1, replace: dict = None):
         """
-        Adds the given files to the library database.
+        Adds the given files to the library database. Files may be any iterable, such as
+        the generator returned by Scanner.iter_files, so tracks are imported while the
+        directory walk is still running. Tags are read by Scanner.iter_tags, across a pool
+        of jobs worker processes when jobs is greater than 1. Progress and per-stage timings
+        are recorded in self.stats, which starts over on each call. Database rows are written
+        insert_batch_size at a time. replace maps source paths to the existing records
+        add_track should update.
         """
+        self.stats = Stats()
+        return self._add_tracks(files, move=move, jobs=jobs, replace=replace)
+
+    def _add_tracks(self, files: Iterable[str], move: bool = False, jobs: int = 1, replace: dict = None):
         errors = []
-        for track in files:
-            # self.add_track(track, move=move)
-            try:
-                self.add_track(track, move=move)
-            except Exception as e:
-                self.logger.warning(f"Failed to add {track}: {e}")
-                errors.append(track)
-                pass
+        count = 0
+        links = COUNTERS["unicode_link"]
+        copies = COUNTERS["unicode_copy"]
+        try:
+            for track, track_info, error in Scanner.iter_tags(files, workers=jobs, stats=self.stats):
+                count += 1
+                self.stats.add("files")
+                if error is not None:
+                    self.logger.warning(f"Failed to add {track}: {error}")
+                    self.stats.error(error)
+                    errors.append(track)
+                    continue
+                # self.add_track(track, move=move)
+                try:
+                    self.add_track(track, move=move, track_info=track_info, defer=True, replace=(replace or {}).get(track))
+                except Exception as e:
+                    self.logger.warning(f"Failed to add {track}: {e}")
+                    self.stats.error(e)
+                    errors.append(track)
+                    pass
+                if self.stats.due(self.progress_interval):
+                    self.logger.info(self.stats.progress_line())
+        finally:
+            self._flush_inserts()
+        errors.extend(self._failed_inserts)
+        self._failed_inserts = []
+        self.logger.info(f"Processed {count} files")
+        links = COUNTERS["unicode_link"] - links
+        copies = COUNTERS["unicode_copy"] - copies
+        if links or copies:
+            self.logger.info(f"Opened {links + copies} files taglib couldn't encode through a temporary path ({copies} copied)")
+            self.stats.add("unicode_link", links)
+            self.stats.add("unicode_copy", copies)
+        self.logger.info(self.stats.progress_line())
         return errors
 
     def prune(self):
         """
         Prune the library database of tracks that no longer exist.
         """
-        existing = [i["path"] for i in Track.all()]
-        for track in existing:
-            if not Path(track).exists():
-                Track(path=track).delete()
-                self.logger.info(f"Pruned [{track}]")
+        missing = []
+        for track in Track.iter_all(columns=["path"]):
+            if not Path(track["path"]).exists():
+                missing.append(track["id"])
+                self.logger.info(f"Pruned [{track['path']}]")
+        if missing:
+            Track.delete_many(missing)
+            self.stats.add("pruned", len(missing))
         self._remove_empty_dirs(self.path)
 
-    def scan(self):
+    def scan(self, jobs: int = 1, incremental: bool = False):
         """
-        Re-scans the library to update the database.
+        Re-scans the library to update the database. self.stats starts over on each call.
         """
+        self.stats = Stats()
+        if incremental:
+            return self._scan_incremental(jobs=jobs)
         self.logger.info(f"Scanning [{self.path}]")
-        existing = [i["path"] for i in Track.all()]
+        existing = set(Track.column("path"))
         scanner = Scanner(self.path)
-        files = scanner.scan(exclude_files=existing)
+        files = scanner.iter_files(exclude_files=existing)
         # print(existing)
-        self.logger.info(f"Found {len(files)} new files")
-        errors = self.add_tracks(files, move=True)
+        errors = self._add_tracks(files, move=True, jobs=jobs)
         self.logger.info("Pruning library ...")
         self.prune()
         return errors
 
+    def _scan_incremental(self, jobs: int = 1):
+        """
+        Re-scans the library, comparing each file against the fingerprint stored when it was
+        added. Tags are only re-read for new files and files whose fingerprint changed, whose
+        records are updated in place, and tracks whose files are gone are removed from the
+        database.
+        """
+        self.logger.info(f"Scanning [{self.path}] (incremental)")
+        known = {}
+        for row in Track.iter_execute("SELECT id, path, " + ", ".join(FINGERPRINT_FIELDS) + " FROM tracks"):
+            known[row["path"]] = row
+        counts = {
+            "new": 0,
+            "changed": 0,
+            "unchanged": 0,
+            "deleted": 0
+        }
+        changed = {}
+        backfill = []
+
+        def flush_backfill():
+            with transaction():
+                for row, current in backfill:
+                    Track(from_dict=row).update(**current)
+            backfill.clear()
+
+        def candidates():
+            for entry in Scanner(self.path).iter_entries():
+                row = known.pop(entry.path, None)
+                if row is None:
+                    counts["new"] += 1
+                    yield entry.path
+                    continue
+                current = fingerprint(entry.stat())
+                if row["size"] is None:
+                    # Added before fingerprints were stored, record it without re-reading tags
+                    backfill.append((row, current))
+                    if len(backfill) >= self.insert_batch_size:
+                        flush_backfill()
+                    counts["unchanged"] += 1
+                elif all(row[field] == current[field] for field in FINGERPRINT_FIELDS):
+                    counts["unchanged"] += 1
+                else:
+                    self.logger.info(f"Changed [{entry.path}]")
+                    counts["changed"] += 1
+                    changed[entry.path] = Track(from_dict=row)
+                    yield entry.path
+
+        errors = self._add_tracks(candidates(), move=True, jobs=jobs, replace=changed)
+        if backfill:
+            flush_backfill()
+        deleted = []
+        for track, row in known.items():
+            # Files outside the walk (unreadable directories, renamed extensions) are left alone
+            if not os.path.exists(track):
+                deleted.append(row["id"])
+                self.logger.info(f"Pruned [{track}]")
+        Track.delete_many(deleted)
+        counts["deleted"] += len(deleted)
+        self._remove_empty_dirs(self.path)
+        self.stats.counters.update(counts)
+        self.logger.info("Scan complete: {new} new, {changed} changed, {unchanged} unchanged, {deleted} deleted".format(**counts))
+        return errors
+
     def refresh(self, track_id: int):
         """
         Refresh the track information for the given track.
@@ -197,8 +424,11 @@ class Library:
         self.logger.info("Refreshing track [{track_path}]".format(
             track_path=track_path
         ))
-        track.delete()
-        return self.add_track(track_path, move=True)
+        # Upserted in place when the tags still map to the same path, keeping its id
+        refreshed = self.add_track(track_path, move=True)
+        if refreshed is None or refreshed["id"] != track["id"]:
+            track.delete()
+        return refreshed
 
     def match_missing(self, api: str = "deezer", **kwargs):
         """
@@ -249,22 +479,31 @@ class Library:
                 track_path.parent.mkdir(parents=True, exist_ok=True)
             shutil.move(track["path"], track_path)
         new_info["path"] = str(track_path)
+        # Tags were rewritten, so the stored size and mtime are stale
+        new_info.update(fingerprint(track_path.stat()))
+        with transaction():
+            updated = Track.upsert(**new_info)
+            if updated["id"] != track["id"]:
+                # Moved onto a new path, or onto the record of one already there
+                track.delete()
+        return updated
+
+    def watch(self, inboxes: list = None, settle: float = 2.0, jobs: int = 1):
+        """
+        Keep the library up to date from filesystem events until interrupted. Inboxes from
+        the library config are watched along with any given here.
+        """
+        from muzak.watch import Watcher
+        inboxes = list(self.library_config["inboxes"] or []) + list(inboxes or [])
+        cache = Track.enable_cache(self.row_cache_size)
         try:
-            track = Track(path=str(track_path))
-            self.logger.info("Existing record found for new track path: [{track_path}], updating database ...".format(
-                track_path=track_path
-            ))
-            del new_info["path"]
-            track.update(**new_info)
-            return track
-        except Exception:
-            pass
-        track.delete()
-        track = Track.new(**new_info)
-        return track
+            Watcher(self, inboxes=inboxes, settle=settle, jobs=jobs).run()
+        finally:
+            Track.disable_cache()
+            self.logger.info("Row cache: {hits} hits, {misses} misses, {evictions} evictions".format(**cache.stats()))
 
-    def search(self, query: str):
+    def search(self, query: str, limit: int = None):
         """
-        Search the library for the given query.
+        Search the library for the given query, best matches first.
         """
-        return Track.search(query)
+        return Track.search(query, limit=limit)
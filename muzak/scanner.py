@@ -1,10 +1,16 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 import shutil
 import tempfile
-from typing import List, Dict, Mapping
+from typing import Iterable, Iterator, List, Dict, Mapping, Tuple
 import taglib
+import time
 import os
 
+from muzak import fasttags
+from muzak.ignore import IGNORE_FILENAME, IgnoreMatcher
+from muzak.stats import Stats
+
 AUDIO_EXTENSIONS = [
     ".mp3",
     ".ogg",
@@ -66,98 +72,314 @@ TAG_FIELDS = {
 }
 
 
+
+def _convert_list(values: list):
+    _values = [i for i in values if i]
+    if len(_values) == 0:
+        return ["Unknown"]
+    return _values
+
+
+def _converter(ty: type):
+    def convert(values: list):
+        try:
+            return ty(values[0])
+        except (ValueError, TypeError, IndexError):
+            return "Unknown"
+    return convert
+
+
+def _compile_tag_fields(tag_fields: dict) -> Dict[str, Tuple[int, str, callable]]:
+    """
+    Build a map from uppercased tag key to (priority, field, converter). Keys that
+    only differ in case collapse into one entry, and a lower priority wins when a
+    file has more than one key for the same field.
+    """
+    tag_map = {}
+    for field, key_info in tag_fields.items():
+        if key_info["type"] == list:
+            convert = _convert_list
+        else:
+            convert = _converter(key_info["type"])
+        for priority, key in enumerate(key_info["keys"]):
+            key = key.upper()
+            if key not in tag_map:
+                tag_map[key] = (priority, field, convert)
+    return tag_map
+
+
+TAG_MAP = _compile_tag_fields(TAG_FIELDS)
+# Uppercased tag keys the scanner looks at, so the fast reader can skip everything else
+TAG_KEYS = set(TAG_MAP)
+TAG_DEFAULTS = [(field, ["Unknown"] if key_info["type"] == list else "Unknown") for field, key_info in TAG_FIELDS.items()]
+
+FINGERPRINT_FIELDS = ["size", "mtime_ns", "inode", "device"]
+
+
+def fingerprint(stat: os.stat_result) -> Dict[str, int]:
+    """
+    Build the fingerprint stored alongside each track, used to tell whether a file changed
+    since it was last scanned.
+    """
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "inode": stat.st_ino,
+        "device": stat.st_dev
+    }
+
+# How often each slow path was taken. Worker processes report theirs back through Scanner.iter_tags.
+COUNTERS = {
+    "unicode_link": 0,
+    "unicode_copy": 0
+}
+
+
+def _encodable(path: str) -> bool:
+    try:
+        path.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _taglib_tags(path: str) -> Dict[str, List[str]]:
+    file_info = taglib.File(path)
+    try:
+        return file_info.tags
+    finally:
+        file_info.close()
+
+
+def _taglib_tags_via_link(path: str) -> Dict[str, List[str]]:
+    """
+    Read tags for a path taglib can't encode by opening it through an ASCII-named symlink in
+    a private temp directory. Only if the symlink can't be created is the file copied there
+    instead. Either way the directory is removed before returning.
+    """
+    suffix = Path(path).suffix
+    if not suffix.isascii():
+        suffix = ""
+    tmpdir = tempfile.mkdtemp(prefix="muzak-")
+    link = os.path.join(tmpdir, "track" + suffix)
+    try:
+        try:
+            os.symlink(os.path.abspath(path), link)
+            COUNTERS["unicode_link"] += 1
+        except OSError:
+            shutil.copyfile(path, link)
+            COUNTERS["unicode_copy"] += 1
+        return _taglib_tags(link)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
 class Scanner:
-    def __init__(self, path: str, subdirs: bool = True, audio_extensions: List[str] = AUDIO_EXTENSIONS):
+    def __init__(self, path: str, subdirs: bool = True, audio_extensions: List[str] = AUDIO_EXTENSIONS, ignore_files: bool = True):
         self.path = path
         self.subdirs = subdirs
         self.audio_extensions = audio_extensions
+        self.ignore_files = ignore_files
+
+    def iter_entries(self, path: str = None, exclude_files: list = None, exclude_dirs: list = None) -> Iterator[os.DirEntry]:
+        """
+        Walk the given path (or the scanner path) and yield an os.DirEntry for each audio file as
+        it is found. Directories are walked iteratively with os.scandir, so the file type comes
+        from the cached DirEntry information instead of a stat() call per entry.
+
+        exclude_dirs may hold absolute directory paths or gitignore-style patterns relative to
+        the scanned path. They are compiled into an IgnoreMatcher together with any .muzakignore
+        files found during the walk, and excluded directories are never listed. exclude_files
+        holds exact file paths as produced by the walk.
+        """
+        if path is None:
+            path = self.path
+        matcher = IgnoreMatcher(path, patterns=exclude_dirs, exclude_files=exclude_files)
+        if None in matcher.trie:
+            return
+        stack = [(str(path), "", matcher.trie)]
+        while stack:
+            current, rel, node = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            if self.ignore_files:
+                for entry in entries:
+                    if entry.name == IGNORE_FILENAME:
+                        matcher.load(entry.path, base=rel)
+                        break
+            subdirs = []
+            for entry in entries:
+                entry_rel = rel + "/" + entry.name if rel else entry.name
+                if entry.is_dir():
+                    if self.subdirs:
+                        excluded, child = matcher.enter(node, entry_rel, entry.name)
+                        if not excluded:
+                            subdirs.append((entry.path, entry_rel, child))
+                elif entry.is_file():
+                    if os.path.splitext(entry.name)[1] in self.audio_extensions:
+                        if not matcher.match_file(entry.path, entry_rel, entry.name):
+                            yield entry
+            # Reversed so directories are walked in listing order
+            stack.extend(reversed(subdirs))
+
+    def iter_files(self, path: str = None, exclude_files: list = None, exclude_dirs: list = None) -> Iterator[str]:
+        """
+        Walk the given path (or the scanner path) and yield audio file paths as they are found.
+        """
+        for entry in self.iter_entries(path, exclude_files=exclude_files, exclude_dirs=exclude_dirs):
+            yield entry.path
 
     def _find_files(self, path: str, exclude_files: list = None, exclude_dirs: list = None) -> List[str]:
         """
         Find files matching the given audio extensions in the given path.
         """
-        files = []
-        scan_path = Path(path)
-        listing = os.listdir(path)
-        for item in listing:
-            item_path = scan_path.joinpath(item)
-            if item_path.is_dir():
-                if self.subdirs:
-                    l = self._find_files(str(item_path), exclude_files=exclude_files, exclude_dirs=exclude_dirs)
-                    files.extend(l)
-            elif item_path.is_file():
-                if item_path.suffix in self.audio_extensions:
-                    if exclude_files:
-                        if str(item_path.resolve()) in exclude_files:
-                            continue
-                    if exclude_dirs:
-                        for d in exclude_dirs:
-                            if str(item_path).startswith(d):
-                                break
-                        else:
-                            files.append(str(item_path))
-                    else:
-                        files.append(str(item_path))
-        return files
+        return list(self.iter_files(path, exclude_files=exclude_files, exclude_dirs=exclude_dirs))
     
     @staticmethod
-    def scan_file(path: str) -> Dict[str, str]:
-        try:
-            file_info = taglib.File(path)
-        except UnicodeEncodeError as e:
-            tmpfile_name = tempfile.mkstemp(suffix=Path(path).suffix)[1]
-            shutil.copyfile(path, tmpfile_name)
-            file_info = taglib.File(tmpfile_name)
-
-        track_info = {}
-        track_info["path"] = path
-        for field, key_info in TAG_FIELDS.items():
-            if field in track_info:
+    def read_tags(path: str, fast: bool = True) -> Dict[str, List[str]]:
+        """
+        Read the raw tags of the given file, using the header-only reader in muzak.fasttags
+        when possible and taglib otherwise.
+        """
+        if fast:
+            tags = fasttags.read_tags(path, keys=TAG_KEYS)
+            if tags is not None:
+                return tags
+        if _encodable(path):
+            try:
+                return _taglib_tags(path)
+            except UnicodeEncodeError:
+                pass
+        return _taglib_tags_via_link(path)
+
+    @staticmethod
+    def scan_file(path: str, fast: bool = True) -> Dict[str, str]:
+        """
+        Read the given file and return its track info, with one entry per TAG_FIELDS field.
+        """
+        return Scanner.track_info(path, Scanner.read_tags(path, fast=fast))
+
+    @staticmethod
+    def track_info(path: str, tags: Mapping[str, List[str]]) -> Dict[str, str]:
+        """
+        Map raw tags onto TAG_FIELDS in a single pass over the tags, using the compiled TAG_MAP.
+        Fields without a usable tag are set to "Unknown".
+        """
+        found = {}
+        for key, values in tags.items():
+            entry = TAG_MAP.get(key.upper())
+            if entry is None:
                 continue
-            for key in key_info["keys"]:
-                if key in file_info.tags:
-                    if isinstance(file_info.tags[key], list) and key_info["type"] == list:
-                        _i = []
-                        for i in file_info.tags[key]:
-                            if i:
-                                _i.append(i)
-                        if len(_i) == 0:
-                            _i = ["Unknown"]
-                        track_info[field] = _i
-                    else:
-                        try:
-                            track_info[field] = key_info["type"](file_info.tags[key][0])
-                        except:
-                            track_info[field] = "Unknown"
-                    break
-                else:
-                    if key_info["type"] == list:
-                        track_info[field] = ["Unknown"]
-                    else:
-                        track_info[field] = "Unknown"
+            current = found.get(entry[1])
+            if current is None or entry[0] < current[0]:
+                found[entry[1]] = (entry[0], entry[2], values)
+        track_info = {"path": path}
+        for field, default in TAG_DEFAULTS:
+            match = found.get(field)
+            if match is None:
+                track_info[field] = list(default) if isinstance(default, list) else default
+            else:
+                track_info[field] = match[1](match[2])
         return track_info
 
+    @staticmethod
+    def scan_files(paths: Iterable[str], fast: bool = True, timings: list = None) -> Iterator[Tuple[str, dict, Exception]]:
+        """
+        Read track info for each of the given files, yielding (path, track_info, error) tuples
+        with per-file errors collected instead of raised. When timings is given, the time spent
+        reading each file is appended to it.
+        """
+        for path in paths:
+            start = time.perf_counter()
+            try:
+                result = (path, Scanner.track_info(path, Scanner.read_tags(path, fast=fast)), None)
+            except Exception as e:
+                result = (path, None, e)
+            if timings is not None:
+                timings.append(time.perf_counter() - start)
+            yield result
+
     def scan(self, exclude_files: list = None, exclude_dirs: list = None) -> List[str]:
         """
         Scan the given path for music files.
         """
         return self._find_files(self.path, exclude_files=exclude_files, exclude_dirs=exclude_dirs)
     
-    def scan_with_tags(self, exclude: list = None) -> List[dict]:
+    def scan_with_tags(self, exclude: list = None, workers: int = 1) -> List[dict]:
         """
-        Scan the given path for music files, and return a list of taglib.File objects.
+        Scan the given path for music files, and return a list of track info dicts along with
+        a list of files that could not be read.
         """
-        files = self.scan(exclude=exclude)
+        files = self.iter_files(exclude_files=exclude)
         tagged_files = []
         errors = []
-        for f in files:
-            try:
-                track_info = Scanner.scan_file(f)
-            except Exception as e:
+        for f, track_info, error in Scanner.iter_tags(files, workers=workers):
+            if error is not None:
                 errors.append({
                     "path": f,
-                    "error": e
+                    "error": error
                 })
                 continue
             tagged_files.append(track_info)
         return tagged_files, errors
+
+    @staticmethod
+    def iter_tags(files: Iterable[str], workers: int = 1, batch_size: int = 16, stats: Stats = None) -> Iterator[Tuple[str, dict, Exception]]:
+        """
+        Read tags for the given files and yield (path, track_info, error) tuples as they complete.
+        With more than one worker, files are handed to a process pool in batches of batch_size,
+        and results come back in completion order rather than input order. A workers value of 0
+        uses one worker per CPU. When stats is given, time spent walking and per-file tag read
+        latencies are recorded in the "walk" and "tags" stages.
+        """
+        if workers == 0:
+            workers = os.cpu_count() or 1
+        if stats is not None:
+            files = stats.timed("walk", files)
+        if workers <= 1:
+            yield from Scanner.scan_files(files, timings=stats.stage("tags") if stats is not None else None)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            batch = []
+            for f in files:
+                batch.append(f)
+                if len(batch) < batch_size:
+                    continue
+                pending.add(pool.submit(_scan_batch, batch))
+                batch = []
+                # Bound the number of in-flight batches so a fast walk can't queue the whole tree
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from _batch_results(future, stats)
+            if batch:
+                pending.add(pool.submit(_scan_batch, batch))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from _batch_results(future, stats)
+
+
+def _scan_batch(paths: List[str]) -> Tuple[List[Tuple[str, dict, Exception]], Dict[str, int], List[float]]:
+    """
+    Read tags for a batch of files in a worker process, returning the results, how much the
+    worker's COUNTERS grew, and per-file read times. Module-level so it can be sent to worker
+    processes.
+    """
+    before = dict(COUNTERS)
+    timings = []
+    results = list(Scanner.scan_files(paths, timings=timings))
+    return results, {k: v - before.get(k, 0) for k, v in COUNTERS.items()}, timings
+
+
+def _batch_results(future, stats: Stats = None) -> List[Tuple[str, dict, Exception]]:
+    results, counters, timings = future.result()
+    for k, v in counters.items():
+        COUNTERS[k] = COUNTERS.get(k, 0) + v
+    if stats is not None:
+        stats.stage("tags").extend(timings)
+    return results
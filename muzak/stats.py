@@ -0,0 +1,162 @@
+"""
+Per-stage counters and timings for scans and imports.
+"""
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+import json
+import time
+from typing import Iterable, Iterator
+
+PERCENTILES = [50, 90, 99]
+
+
+class Stage:
+    """
+    Time spent in one stage. Latency samples are kept per call so percentiles can be
+    reported, in a compact array of doubles.
+    """
+    __slots__ = ("count", "seconds", "samples")
+
+    def __init__(self, sampled: bool = True):
+        self.count = 0
+        self.seconds = 0.0
+        self.samples = array("d") if sampled else None
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        if self.samples is not None:
+            self.samples.append(seconds)
+
+    def add_batch(self, seconds: float, rows: int):
+        """
+        Record a call that handled rows items at once as rows calls of equal length, so
+        per-row latency stays comparable with stages timed one item at a time.
+        """
+        if rows < 1:
+            return
+        for _ in range(rows):
+            self.add(seconds / rows)
+
+    # Lets a Stage stand in for the plain list of timings Scanner.scan_files fills
+    append = add
+
+    def extend(self, samples: Iterable[float]):
+        for seconds in samples:
+            self.add(seconds)
+
+    def percentiles(self) -> dict:
+        if not self.samples:
+            return {}
+        ordered = sorted(self.samples)
+        result = {}
+        for p in PERCENTILES:
+            index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+            result["p%d_ms" % p] = round(ordered[index] * 1000, 3)
+        result["max_ms"] = round(ordered[-1] * 1000, 3)
+        return result
+
+    def summary(self) -> dict:
+        summary = {
+            "count": self.count,
+            "seconds": round(self.seconds, 4)
+        }
+        summary.update(self.percentiles())
+        return summary
+
+
+class Stats:
+    """
+    Counters, stage timings and error counts for one scan or import.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = Counter()
+        self.errors = Counter()
+        self.stages = {}
+        self._last_progress = self.started
+
+    def stage(self, name: str, sampled: bool = True) -> Stage:
+        if name not in self.stages:
+            self.stages[name] = Stage(sampled=sampled)
+        return self.stages[name]
+
+    @contextmanager
+    def time(self, name: str, rows: int = 1):
+        """
+        Time the block towards the given stage. A block handling several rows at once is
+        recorded as one sample per row.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage(name).add_batch(time.perf_counter() - start, rows)
+
+    def timed(self, name: str, iterable: Iterable) -> Iterator:
+        """
+        Yield from iterable, counting the time spent producing each item towards the given
+        stage. Used for lazily evaluated stages such as the directory walk.
+        """
+        stage = self.stage(name, sampled=False)
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                stage.seconds += time.perf_counter() - start
+                return
+            stage.add(time.perf_counter() - start)
+            yield item
+
+    def add(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def error(self, error: Exception):
+        self.errors[type(error).__name__] += 1
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def due(self, interval: float) -> bool:
+        """
+        Whether interval seconds have passed since the last time this returned True.
+        """
+        now = time.monotonic()
+        if now - self._last_progress >= interval:
+            self._last_progress = now
+            return True
+        return False
+
+    def progress_line(self) -> str:
+        elapsed = self.elapsed()
+        files = self.counters["files"]
+        parts = [
+            "%d files in %.0fs (%.1f/s)" % (files, elapsed, files / elapsed if elapsed else 0),
+            "%.1f MB copied" % (self.counters["bytes_copied"] / 1e6)
+        ]
+        for name in ("tags", "copy", "db_insert"):
+            if name in self.stages:
+                p = self.stages[name].percentiles()
+                if p:
+                    parts.append("%s p50 %.1fms p99 %.1fms" % (name, p["p50_ms"], p["p99_ms"]))
+        if self.errors:
+            parts.append("%d errors" % sum(self.errors.values()))
+        return ", ".join(parts)
+
+    def summary(self) -> dict:
+        elapsed = self.elapsed()
+        files = self.counters["files"]
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "files_per_sec": round(files / elapsed, 1) if elapsed else None,
+            "counters": dict(self.counters),
+            "stages": {name: stage.summary() for name, stage in self.stages.items()},
+            "errors": dict(self.errors)
+        }
+
+    def dump(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
@@ -0,0 +1,319 @@
+"""
+Keep a library up to date from inotify events instead of full rescans (Linux only).
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import List, Tuple
+
+from muzak.db import NoSuchRowError
+from muzak.db.models import Track
+from muzak.ignore import IGNORE_FILENAME, IgnoreMatcher
+from muzak.scanner import AUDIO_EXTENSIONS, Scanner, fingerprint
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+ADD = "add"
+REMOVE = "remove"
+REMOVE_TREE = "remove_tree"
+
+
+class Inotify:
+    """
+    Minimal ctypes binding for the inotify syscalls.
+    """
+    def __init__(self):
+        name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(name, use_errno=True) if name else None
+        if libc is None or not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: float = None) -> List[Tuple[int, int, str]]:
+        """
+        Wait up to timeout seconds for events and return them as (wd, mask, name) tuples.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """
+    Watch the library root and any inbox directories, and feed settled changes into the
+    library. Bursts of events are coalesced per path, and a path is only acted on once it
+    has been quiet for settle seconds, so an album being copied in is imported once the
+    copy is done. Files that appear in an inbox are moved into the library, new files in
+    the library itself are organized in place, and removed files are dropped from the
+    database.
+    """
+    def __init__(self, library, inboxes: List[str] = None, settle: float = 2.0, jobs: int = 1):
+        """
+        :param library: The muzak.library.Library to keep up to date.
+        :param inboxes: Directories whose new files should be moved into the library.
+        :param settle: Seconds a path has to be quiet before it is processed.
+        :param jobs: Number of worker processes used to read tags.
+        """
+        self.library = library
+        self.logger = library.logger
+        self.settle = settle
+        self.jobs = jobs
+        self.inotify = Inotify()
+        self.roots = {}
+        self.watches = {}
+        # Ignore files already loaded into their root's matcher
+        self.ignore_files = set()
+        self.pending = {}
+        self.add_root(str(library.path), inbox=False)
+        for inbox in inboxes or []:
+            self.add_root(str(inbox), inbox=True)
+
+    def add_root(self, root: str, inbox: bool):
+        self.roots[root] = (inbox, IgnoreMatcher(root))
+        self._reconcile(root)
+
+    def _reconcile(self, root: str):
+        """
+        Watch every directory below root, and queue the files already in it if it's an inbox.
+        """
+        self._watch_tree(root, root)
+        if self.roots[root][0]:
+            # Pick up anything that arrived while nothing was watching
+            for path in Scanner(root).iter_files():
+                self._queue(path, ADD)
+
+    def _root_for(self, path: str) -> str:
+        for root in self.roots:
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return root
+        return None
+
+    def _rel(self, root: str, path: str) -> str:
+        return os.path.relpath(path, root).replace(os.sep, "/")
+
+    def _load_ignore(self, root: str, path: str):
+        """
+        Load an ignore file found below root into the root's matcher, anchored at its directory.
+        """
+        if path in self.ignore_files:
+            return
+        self.ignore_files.add(path)
+        directory = os.path.dirname(path)
+        base = self._rel(root, directory) if directory != root else ""
+        self.roots[root][1].load(path, base=base)
+
+    def _watch_tree(self, root: str, path: str):
+        """
+        Add watches for path and every directory below it that isn't ignored, loading the
+        ignore files found on the way as the scanner does.
+        """
+        matcher = self.roots[root][1]
+        stack = [path]
+        while stack:
+            current = stack.pop()
+            try:
+                wd = self.inotify.add_watch(current, WATCH_MASK)
+            except OSError as e:
+                self.logger.warning(f"Unable to watch [{current}]: {e}")
+                continue
+            self.watches[wd] = (root, current)
+            try:
+                with os.scandir(current) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            # Rules from this directory apply to its own subdirectories
+            for entry in entries:
+                if entry.name == IGNORE_FILENAME:
+                    self._load_ignore(root, entry.path)
+                    break
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not matcher.ignored(self._rel(root, entry.path), is_dir=True):
+                        stack.append(entry.path)
+
+    def _unwatch_tree(self, path: str):
+        prefix = path.rstrip(os.sep) + os.sep
+        for wd, (root, watched) in list(self.watches.items()):
+            if watched == path or watched.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def _queue(self, path: str, action: str):
+        self.pending[path] = (action, time.monotonic())
+
+    def _handle(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            self.logger.warning("inotify queue overflowed, reconciling with an incremental scan ...")
+            # Directories created while events were lost have no watch yet
+            for root in self.roots:
+                self._reconcile(root)
+            self.library.scan(jobs=self.jobs, incremental=True)
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        if wd not in self.watches:
+            return
+        root, directory = self.watches[wd]
+        path = os.path.join(directory, name)
+        matcher = self.roots[root][1]
+        is_dir = bool(mask & IN_ISDIR)
+        if name == IGNORE_FILENAME and not is_dir:
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._load_ignore(root, path)
+            return
+        if matcher.ignored(self._rel(root, path), is_dir=is_dir):
+            return
+        if is_dir:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(root, path)
+                # Files can land before the new watch exists
+                for f in Scanner(path).iter_files():
+                    if not matcher.ignored(self._rel(root, f)):
+                        self._queue(f, ADD)
+            elif mask & IN_MOVED_FROM:
+                self._unwatch_tree(path)
+                self._queue(path, REMOVE_TREE)
+            return
+        if os.path.splitext(name)[1] not in AUDIO_EXTENSIONS:
+            return
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._queue(path, ADD)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self._queue(path, REMOVE)
+
+    def poll(self, timeout: float = None):
+        """
+        Read events for up to timeout seconds, then process every path that has settled.
+        """
+        for wd, mask, name in self.inotify.read(timeout):
+            self._handle(wd, mask, name)
+        self.flush()
+
+    def flush(self, force: bool = False):
+        """
+        Process settled paths, or every pending path when force is set.
+        """
+        now = time.monotonic()
+        due = {}
+        for path, (action, seen) in list(self.pending.items()):
+            if force or now - seen >= self.settle:
+                due[path] = action
+                del self.pending[path]
+        if not due:
+            return
+        adds = []
+        for path, action in due.items():
+            if action == ADD:
+                if not os.path.isfile(path):
+                    continue
+                root = self._root_for(path)
+                if root is not None and self.roots[root][0]:
+                    adds.append(path)
+                elif self._changed(path):
+                    adds.append(path)
+            elif action == REMOVE:
+                self._remove(path)
+            elif action == REMOVE_TREE:
+                self._remove_tree(path)
+        if adds:
+            # Inbox files are moved into the library, library files are organized in place
+            self.library.add_tracks(adds, move=True, jobs=self.jobs)
+
+    def _changed(self, path: str) -> bool:
+        """
+        Whether a file in the library needs importing. Known files are refreshed in place
+        when their fingerprint changed, and skipped otherwise, which also covers the copies
+        the library makes itself.
+        """
+        try:
+            track = Track(path=path)
+        except NoSuchRowError:
+            return True
+        current = fingerprint(os.stat(path))
+        if any(track[k] != v for k, v in current.items()):
+            self.library.refresh(path)
+        return False
+
+    def _remove(self, path: str):
+        if os.path.exists(path):
+            return
+        try:
+            track = Track(path=path)
+        except NoSuchRowError:
+            return
+        track.delete()
+        self.logger.info(f"Removed [{path}]")
+
+    def _remove_tree(self, path: str):
+        """
+        Drop every track below a directory that was moved away, in one transaction.
+        """
+        missing = []
+        for track in Track.where("substr(path, 1, ?) = ?", len(path) + 1, path + os.sep):
+            if not os.path.exists(track["path"]):
+                missing.append(track["id"])
+                self.logger.info(f"Removed [{track['path']}]")
+        Track.delete_many(missing)
+
+    def _next_timeout(self) -> float:
+        if not self.pending:
+            return None
+        oldest = min(seen for _, seen in self.pending.values())
+        return max(0.0, self.settle - (time.monotonic() - oldest))
+
+    def run(self):
+        """
+        Watch until interrupted.
+        """
+        self.logger.info("Watching [%s]" % "], [".join(self.roots))
+        try:
+            while True:
+                self.poll(self._next_timeout())
+        except KeyboardInterrupt:
+            self.flush(force=True)
+        finally:
+            self.inotify.close()
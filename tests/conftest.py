@@ -0,0 +1,13 @@
+import pytest
+
+from muzak import db
+from muzak.db.models import Track
+
+
+@pytest.fixture
+def database(tmp_path):
+    db.DB_PATH = str(tmp_path / "muzak.db")
+    Track._autoupgrade()
+    yield
+    db.close_all()
+    db.DB_PATH = None
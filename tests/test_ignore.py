@@ -0,0 +1,31 @@
+import os
+
+from muzak.scanner import Scanner
+
+
+def _tree(root, files):
+    for rel in files:
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+
+def _scan(root, **kwargs):
+    return sorted(os.path.relpath(path, root) for path in Scanner(str(root)).iter_files(**kwargs))
+
+
+def test_nested_anchored_literal(tmp_path):
+    _tree(tmp_path, ["a/x/t.mp3", "a/y/t.mp3", "a/y/z.mp3", "b/x/t.mp3"])
+    (tmp_path / "a" / ".muzakignore").write_text("/x\ny/z.mp3\n")
+    assert _scan(tmp_path) == ["a/y/t.mp3", "b/x/t.mp3"]
+
+
+def test_root_anchored_literal(tmp_path):
+    _tree(tmp_path, ["a/b/t.mp3", "b/t.mp3"])
+    (tmp_path / ".muzakignore").write_text("/b\n")
+    assert _scan(tmp_path) == ["a/b/t.mp3"]
+
+
+def test_exclude_patterns_and_paths(tmp_path):
+    _tree(tmp_path, ["a/t.mp3", "b/t.mp3", "c/t.mp3"])
+    assert _scan(tmp_path, exclude_dirs=["b", str(tmp_path / "c")]) == ["a/t.mp3"]
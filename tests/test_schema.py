@@ -0,0 +1,15 @@
+import sqlite3
+
+from muzak import db
+from muzak.db.models import Track
+
+
+def test_upgrade_of_current_schema_needs_no_write_lock(database):
+    writer = sqlite3.connect(db.DB_PATH, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        db.close_all()
+        assert Track._autoupgrade() == []
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
@@ -0,0 +1,13 @@
+from muzak.stats import Stats
+
+
+def test_batch_timing_is_recorded_per_row():
+    stats = Stats()
+    with stats.time("db_insert", rows=4):
+        pass
+    with stats.time("db_insert"):
+        pass
+    stage = stats.stage("db_insert")
+    assert stage.count == 5
+    assert len(stage.samples) == 5
+    assert stage.samples[0] == stage.samples[3]
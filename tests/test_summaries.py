@@ -0,0 +1,68 @@
+from muzak.db.models import Album, AlbumArtist, Track
+
+
+def _track(number, **tags):
+    info = {
+        "title": "Song %d" % number,
+        "artist": ["Artist"],
+        "album": "Album",
+        "album_artist": "Artist",
+        "track": number,
+        "disc": 1,
+        "genre": ["Rock"],
+        "year": 2001,
+        "duration": 100,
+        "path": "/library/%d.flac" % number
+    }
+    info.update(tags)
+    return info
+
+
+def _summaries():
+    albums = [tuple(row)[1:] for row in Album.execute("SELECT * FROM albums ORDER BY album_artist, album")]
+    artists = [tuple(row)[1:] for row in AlbumArtist.execute("SELECT * FROM album_artists ORDER BY album_artist")]
+    return albums, artists
+
+
+def _assert_matches_rebuild():
+    live = _summaries()
+    Track.rebuild_summaries()
+    assert live == _summaries()
+
+
+def test_missing_tags_are_not_aggregated(database):
+    # The scanner stores "Unknown" for int tags it couldn't read
+    first = Track.new(**_track(1, duration="Unknown", disc="Unknown", year="Unknown"))
+    Track.new(**_track(2, year="1999-05-02"))
+    Track.new(**_track(3, disc=2, year=2005, duration=50))
+    album = Album.where("album = ?", "Album")[0]
+    assert album["track_count"] == 3
+    assert album["duration"] == 150
+    assert album["disc_count"] == 2
+    assert album["year"] == 2005
+    assert album["track_id"] == first["id"]
+    _assert_matches_rebuild()
+
+
+def test_all_tags_missing(database):
+    Track.new(**_track(1, duration="Unknown", disc="Unknown", year="Unknown", album_artist="Unknown"))
+    album = Album.where("album_artist = ?", "Unknown")[0]
+    assert (album["duration"], album["disc_count"], album["year"]) == (0, 1, None)
+    artist = AlbumArtist.where("album_artist = ?", "Unknown")[0]
+    assert (artist["track_count"], artist["duration"], artist["year"]) == (1, 0, None)
+    _assert_matches_rebuild()
+
+
+def test_update_and_delete_with_missing_tags(database):
+    tracks = [Track.new(**_track(i, year=2000 + i)) for i in range(1, 4)]
+    tracks[0].update(year="Unknown", duration="Unknown", disc="Unknown")
+    _assert_matches_rebuild()
+    album = Album.where("album = ?", "Album")[0]
+    assert (album["year"], album["duration"]) == (2002, 200)
+    tracks[1].delete()
+    _assert_matches_rebuild()
+    tracks[2].update(album="Other")
+    _assert_matches_rebuild()
+    tracks[0].delete()
+    tracks[2].delete()
+    assert _summaries() == ([], [])
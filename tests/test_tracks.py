@@ -0,0 +1,22 @@
+from muzak.db.models import Track
+
+
+def test_partial_upsert_keeps_links(database):
+    track = Track.upsert(path="/library/1.flac", title="Song", artist=["q"], genre=["Rock"])
+    Track.upsert(path="/library/1.flac", title="Retitled")
+    assert [t["id"] for t in Track.by_artist("q")] == [track["id"]]
+    assert [t["id"] for t in Track.by_genre("Rock")] == [track["id"]]
+    Track.upsert(path="/library/1.flac", artist=["r"])
+    assert Track.by_artist("q") == []
+    assert [t["title"] for t in Track.by_artist("r")] == ["Retitled"]
+    assert [t["id"] for t in Track.by_genre("Rock")] == [track["id"]]
+
+
+def test_iter_where_pages_across_null_sort_values(database):
+    for number in range(20):
+        album = None if number % 3 == 0 else "Album %d" % (number % 4)
+        Track.new(path="/library/%d.flac" % number, title="Song %d" % number, album=album)
+    expected = [t["id"] for t in Track.execute("SELECT id FROM tracks ORDER BY album, id")]
+    for batch_size in (1, 3, 7, 50):
+        rows = list(Track.iter_where(None, order_by="album", batch_size=batch_size))
+        assert [t["id"] for t in rows] == expected